@@ -18,5 +18,38 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 #
 
+import os
+import logging
+
 prog = 'dtest'
 version = '0.0.0'
+
+# Replaced by the dtest command
+logger = logging.getLogger("dtest")
+
+def run(test, result_dir, tmp_dir, path=None, overlays=(), home=None, **options):
+    """
+    Run test - the name of a test case or suite as given on the command
+    line, or a loaded suite - writing its results below result_dir and its
+    tmp files below tmp_dir. Files named by the tests, e.g. vectors, are
+    relative to home (default the current dir). The options are those of
+    runner.DTestRunner, e.g. journal, reporter or timeout. Returns the
+    result object.
+
+    Several runs may be done at the same time in one process, e.g. from
+    threads of a service, as long as they use different result dirs.
+    """
+    import loader
+    import runner
+    import dtestsuite
+    if isinstance(test, basestring):
+        test = loader.DTestLoader(path=path, overlays=list(overlays),
+                                  home=home).loadTestsFromName(test)
+    if options.get('devicepool') is not None:
+        # The device pool runs each of the top-level suites on a device
+        test = dtestsuite.DtestTestSuite([test])
+    for d in (result_dir, tmp_dir):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    return runner.DTestRunner(**options).run(test, os.path.abspath(result_dir),
+                                             os.path.abspath(tmp_dir))
@@ -0,0 +1,342 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Benchmark of the framework itself. Synthetic suite trees of no-op steps
+# are generated, and for each tree the time spent in the main stages of
+# dtest is measured:
+#
+#   load:   DTestLoader.loadTestsFromNames
+#   run:    DTestRunner.run (step_us is the framework overhead per step)
+#   parse:  result_parse.generate_node_tree
+#   report: the node tree walk of ReportGenerator (skipped if the report
+#           dependencies are not installed)
+#
+# With --yaml the result.yaml files of the first tree are also loaded and
+# dumped again, once with the pure Python PyYAML loader/dumper and once with
+# dtest.yamlio, to show the gain of the libyaml based I/O.
+#
+# The trees are:
+#
+#   wide:   one suite with all the steps
+#   deep:   a chain of nested suites with the steps spread over the levels
+#   count:  a sub-suite repeated using count
+#   retry:  steps failing once before passing using retry
+#
+# Usage:
+#
+#   python -m dtest.benchmark --steps 10000 --output bench.yaml
+#   python -m dtest.benchmark --steps 10000 --baseline bench.yaml --threshold 0.2
+#
+# Each tree is run once to warm up and then --repeat times. The time of a
+# stage is the fastest of the repetitions - the one least disturbed by
+# other load of the host. The number of repetitions is stored with the
+# results.
+#
+# With a baseline the run fails (exit code 1) if any stage is more than
+# threshold (relative) and more than min-delta seconds slower than in the
+# baseline. step_us is not compared on its own, it follows run.
+#
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import yaml
+import dtest
+import dtest.yamlio
+from dtest.dtestcase import DtestTestCase
+
+logger = logging.getLogger("benchmark")
+
+SHAPES = ('wide', 'deep', 'count', 'retry')
+STAGES = ('load', 'run', 'step_us', 'parse', 'report')
+# The stages compared with the baseline
+TIMED = ('load', 'run', 'parse', 'report')
+
+class Noop(DtestTestCase):
+    """Step doing nothing - measures the framework overhead only."""
+
+    def runTest(self):
+        pass
+
+class Flaky(DtestTestCase):
+    """Step failing every other attempt - exercises retry."""
+
+    def __init__(self, methodName='runTest'):
+        self.attempts = 0
+        super(Flaky, self).__init__(methodName)
+
+    def runTest(self):
+        self.attempts += 1
+        if self.attempts % 2:
+            self.fail('failing on purpose')
+
+def _write_suite(path, name, tests, description=None):
+    spec = {'description': description or 'benchmark suite %s'%(name),
+            'tests': tests}
+    with open(os.path.join(path, name + '.yaml'), 'w') as f:
+        yaml.safe_dump(spec, f)
+
+def generate(path, shape, steps, depth=10, count=10):
+    """Generate the suite tree shape with about steps steps in path"""
+    def noop(n):
+        return [ {'dtest.benchmark.Noop': None} for i in range(n) ]
+
+    if shape == 'wide':
+        _write_suite(path, 'wide', noop(steps))
+    elif shape == 'deep':
+        per_level = max(1, steps // depth)
+        for level in range(depth):
+            tests = noop(per_level)
+            if level < depth - 1:
+                tests.append({'deep%d'%(level + 1): None})
+            _write_suite(path, 'deep%d'%(level), tests)
+        shutil.copy(os.path.join(path, 'deep0.yaml'), os.path.join(path, 'deep.yaml'))
+    elif shape == 'count':
+        _write_suite(path, 'countleaf', noop(max(1, steps // count)))
+        _write_suite(path, 'count', [{'countleaf': {'count': count}}])
+    elif shape == 'retry':
+        # Each step runs twice - the first attempt fails
+        _write_suite(path, 'retry',
+                     [ {'dtest.benchmark.Flaky': {'retry': 2}}
+                       for i in range(max(1, steps // 2)) ])
+    else:
+        raise TypeError('unknown benchmark shape: %s'%(shape))
+    return shape
+
+def _report(result_dir, tmp_dir, tree):
+    try:
+        import dtest.report_gen as report_gen
+    except ImportError, e:
+        logger.warning("report stage skipped: %s"%(e))
+        return None
+
+    config = os.path.join(tmp_dir, 'report.cfg')
+    with open(config, 'w') as f:
+        yaml.safe_dump({'equipment': {}, 'software': {}}, f)
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        if not os.path.isdir('doc'):
+            os.mkdir('doc')
+        open(os.path.join('doc', 'VersionInformation.txt'), 'w').close()
+        generator = report_gen.ReportGenerator(result_dir=result_dir, tmp_dir=tmp_dir,
+                                               config_file=config)
+        start = time.time()
+        generator.output_open()
+        for node in tree.children:
+            generator.niceprint_overview_suites(node, maxdepth=1, mindepth=0)
+        generator.niceprint_suites_headings(tree)
+        generator.outStream.close()
+        return time.time() - start
+    finally:
+        os.chdir(cwd)
+
+def _result_dir(workdir, shape, run=1):
+    """The result dir of a run of shape"""
+    return os.path.join(workdir, shape, 'run-%d'%(run), 'result')
+
+def measure(workdir, shape, steps, repeat=5):
+    """
+    Generate the shape and run it repeat times after a warm-up run.
+    Returns a dict with the fastest time of each stage.
+    """
+    suite_dir = os.path.join(workdir, shape, 'suite')
+    os.makedirs(suite_dir)
+    name = generate(suite_dir, shape, steps)
+
+    runs = []
+    for run in range(repeat + 1):
+        res_dir = _result_dir(workdir, shape, run)
+        tmp_dir = os.path.join(os.path.dirname(res_dir), 'tmp')
+        for d in (res_dir, tmp_dir):
+            os.makedirs(d)
+        timing = measure_run(suite_dir, name, res_dir, tmp_dir)
+        if run > 0:
+            runs.append(timing)
+
+    timing = {'steps': runs[0]['steps']}
+    for stage in STAGES:
+        times = [ r[stage] for r in runs if r[stage] is not None ]
+        timing[stage] = min(times) if times else None
+    return timing
+
+def measure_run(suite_dir, name, result_dir, tmp_dir):
+    """Run the suite name once. Returns a dict with the time of each stage"""
+    import dtest.loader
+    import dtest.runner
+    import dtest.result_parse
+
+    timing = {}
+
+    start = time.time()
+    suite = dtest.loader.DTestLoader(path=[suite_dir]).loadTestsFromNames([name])
+    timing['load'] = time.time() - start
+
+    start = time.time()
+    result = dtest.runner.DTestRunner(show_errors=False, show_summary=False,
+                                reporter='quiet').run(suite._tests[0], result_dir, tmp_dir)
+    timing['run'] = time.time() - start
+    timing['steps'] = result.testsRun
+    timing['step_us'] = 1e6 * timing['run'] / max(1, result.testsRun)
+
+    start = time.time()
+    tree = dtest.result_parse.generate_node_tree(result_dir)
+    timing['parse'] = time.time() - start
+
+    timing['report'] = _report(result_dir, tmp_dir, tree)
+    return timing
+
+def measure_yaml(result_dir, repeat=3):
+    """
+    Load and dump the result.yaml files in result_dir with the pure Python
+    PyYAML and with yamlio. Returns a dict with the time of each
+    """
+    texts = []
+    for dirpath, dirnames, filenames in os.walk(result_dir):
+        if 'result.yaml' in filenames:
+            with open(os.path.join(dirpath, 'result.yaml'), 'r') as f:
+                texts.append(f.read())
+
+    def run(load_all, dump_all):
+        start = time.time()
+        for i in range(repeat):
+            for text in texts:
+                dump_all(list(load_all(text)), explicit_start=True)
+        return time.time() - start
+
+    timing = {'files': len(texts), 'bytes': sum([ len(t) for t in texts ])}
+    timing['python'] = run(lambda text: yaml.load_all(text, Loader=yaml.SafeLoader),
+                           lambda docs, **kw: yaml.dump_all(docs, Dumper=yaml.SafeDumper, **kw))
+    timing['yamlio'] = run(dtest.yamlio.load_all, dtest.yamlio.dump_all)
+    return timing
+
+def compare(results, baseline, threshold, min_delta=0.0):
+    """
+    Return a list of the stages slower than baseline by more than threshold
+    (relative) and min_delta (seconds). results and baseline are dicts of
+    the shapes as returned by measure.
+    """
+    regressions = []
+    for shape in results:
+        if not shape in baseline:
+            continue
+        for stage in TIMED:
+            new = results[shape].get(stage)
+            old = baseline[shape].get(stage)
+            if new is None or old is None or old <= 0:
+                continue
+            ratio = new / old
+            if ratio > 1.0 + threshold and new - old > min_delta:
+                regressions.append((shape, stage, old, new, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='%s.benchmark'%(dtest.prog),
+        description='Benchmark the dtest framework using synthetic suite trees.')
+    parser.add_argument('--steps', type=int, default=1000,
+                        help="number of steps per tree [default: %(default)s]")
+    parser.add_argument('--shape', action='append', choices=SHAPES,
+                        help="tree shape to run (repeatable) [default: all]")
+    parser.add_argument('--output', type=str,
+                        help="store the results in this file")
+    parser.add_argument('--baseline', type=str,
+                        help="compare against results stored with --output")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of runs of each tree after a warm-up run, the fastest"
+                        " counts [default: %(default)s]")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed relative slow down compared to the baseline"
+                        " [default: %(default)s]")
+    parser.add_argument('--min-delta', type=float, default=0.01,
+                        help="slow downs of a stage by less than this many seconds are"
+                        " not regressions [default: %(default)s]")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the generated trees and results")
+    parser.add_argument('--yaml', action='store_true',
+                        help="also compare the pure Python YAML I/O with dtest.yamlio"
+                        " on the result files")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    logging.basicConfig(level=logging.WARNING)
+    if not hasattr(dtest, 'logger'):
+        dtest.logger = logging.getLogger()
+
+    workdir = tempfile.mkdtemp(prefix='dtest-benchmark-')
+    results = {}
+    yaml_timing = None
+    try:
+        for shape in args.shape or SHAPES:
+            results[shape] = measure(workdir, shape, args.steps, args.repeat)
+        if args.yaml:
+            shape = (args.shape or SHAPES)[0]
+            yaml_timing = measure_yaml(_result_dir(workdir, shape))
+    finally:
+        if args.keep:
+            print 'Benchmark trees kept in %s'%(workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    print '%-8s %8s %10s %10s %10s %10s %10s'%(
+        'shape', 'steps', 'load [s]', 'run [s]', 'step [us]', 'parse [s]', 'report [s]')
+    for shape in args.shape or SHAPES:
+        r = results[shape]
+        report = '%10.3f'%(r['report']) if r['report'] is not None else '%10s'%('-')
+        print '%-8s %8d %10.3f %10.3f %10.1f %10.3f %s'%(
+            shape, r['steps'], r['load'], r['run'], r['step_us'], r['parse'], report)
+
+    if yaml_timing is not None:
+        y = yaml_timing
+        print 'YAML I/O of %d result files (%d bytes): python %.3f s, yamlio%s %.3f s (x%.1f)'%(
+            y['files'], y['bytes'], y['python'],
+            ' (libyaml)' if dtest.yamlio.libyaml else '', y['yamlio'],
+            y['python'] / max(y['yamlio'], 1e-6))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            yaml.safe_dump({'repeat': args.repeat, 'shapes': results}, f,
+                           default_flow_style=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = yaml.safe_load(f)
+        if not 'shapes' in baseline:
+            # Stored before the runs were repeated
+            baseline = {'repeat': 1, 'shapes': baseline}
+        if baseline['repeat'] != args.repeat:
+            print 'WARNING: the baseline is the fastest of %d runs, this is of %d'%(
+                baseline['repeat'], args.repeat)
+        regressions = compare(results, baseline['shapes'], args.threshold, args.min_delta)
+        for shape, stage, old, new, ratio in regressions:
+            print 'REGRESSION: %s %s %.4g -> %.4g (x%.2f)'%(shape, stage, old, new, ratio)
+        if regressions:
+            return 1
+        print 'No regressions (threshold %.0f%%)'%(100 * args.threshold)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Content-addressed cache of the results of deterministic host-side steps.
+#
+# A step opts in with the cacheable testarg:
+#
+#   unpack_source.tar: { cacheable: true, params: { path: bundle.tar.gz } }
+#
+#   util.generateDupdateFiles: { cacheable: true,
+#                                inputs: [ vectors/create_testvectors.sh ],
+#                                outputs: [ vectors/out ] }
+#
+# The key of a step is a hash of its test class (name and the source of its
+# module), the name and params it was loaded by and the contents of its
+# input files. Inputs and outputs are files or directories - relative
+# paths are relative to the test home. Test classes may declare them
+# instead by overriding DtestTestCase.cacheInputs()/cacheOutputs(). The
+# default output is the tmp dir of the step.
+#
+# When a step passes, its outputs are copied into the cache. On a cache hit
+# the outputs are copied back and the step is recorded as passed without
+# running it. Failing steps are never cached. The cache is bounded in size;
+# the least recently used entries are evicted.
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import logging
+import tempfile
+
+logger = logging.getLogger("cache")
+
+CACHE_DIR = os.path.join(".dtest", "cache")
+
+def _hash_path(digest, path):
+    """Add the names and contents of the files of path to digest"""
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                filename = os.path.join(dirpath, name)
+                digest.update(os.path.relpath(filename, path) + '\0')
+                _hash_file(digest, filename)
+    elif os.path.exists(path):
+        _hash_file(digest, path)
+    else:
+        digest.update('missing\0')
+
+def _hash_file(digest, filename):
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(1 << 16)
+            if not block:
+                break
+            digest.update(block)
+
+def _size(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+def _copy(src, dst):
+    """Copy the file or directory src to dst - replacing dst"""
+    dst = os.path.normpath(dst)
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    elif os.path.exists(dst):
+        os.remove(dst)
+    parent = os.path.dirname(dst)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, symlinks=True)
+    else:
+        shutil.copy2(src, dst)
+
+class ResultCache(object):
+    """
+    The cache directory holds an entry directory per key with the
+    outputs of the step (files/<n>) and entry.json describing them.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size=1024 * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, test, suite):
+        """Return the key of the step test wrapped by suite"""
+        digest = hashlib.sha1()
+        cls = test.__class__
+        digest.update('%s.%s.%s\0'%(cls.__module__, cls.__name__, test._testMethodName))
+        module = sys.modules.get(cls.__module__)
+        try:
+            digest.update(inspect.getsource(module))
+        except (TypeError, IOError):
+            pass
+        digest.update(json.dumps([suite.loadname, suite.loadparams],
+                                 sort_keys=True, default=str))
+        for path in test.cacheInputs():
+            digest.update(path + '\0')
+            _hash_path(digest, path)
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, test):
+        """Copy the outputs of key back. Returns the entry (a dict) or None on a miss"""
+        entry_dir = self.entry(key)
+        try:
+            with open(os.path.join(entry_dir, 'entry.json'), 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+
+        outputs = test.cacheOutputs()
+        if len(outputs) != len(entry['outputs']):
+            self.misses += 1
+            return None
+        for i, path in enumerate(outputs):
+            stored = os.path.join(entry_dir, 'files', str(i))
+            if os.path.exists(stored):
+                _copy(stored, path)
+        # Last use - for the LRU eviction
+        os.utime(os.path.join(entry_dir, 'entry.json'), None)
+        self.hits += 1
+        return entry
+
+    def store(self, key, test, record=None):
+        """Store the outputs of the passed step test under key"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Built aside and renamed into place - other processes may store
+        # the same key at the same time
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            outputs = test.cacheOutputs()
+            for i, path in enumerate(outputs):
+                if os.path.exists(path):
+                    _copy(path, os.path.join(tmp, 'files', str(i)))
+            entry = {'test': str(test), 'outputs': outputs,
+                     'stored': time.time(), 'size': _size(tmp)}
+            if record:
+                entry.update(record)
+            with open(os.path.join(tmp, 'entry.json'), 'w') as f:
+                json.dump(entry, f, default=str)
+            try:
+                os.rename(tmp, self.entry(key))
+            except OSError:
+                # Stored by another process meanwhile
+                pass
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size"""
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            filename = os.path.join(self.directory, key, 'entry.json')
+            try:
+                with open(filename, 'r') as f:
+                    size = json.load(f)['size']
+                used = os.path.getmtime(filename)
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            entries.append((used, key, size))
+            total += size
+        entries.sort()
+        while total > self.max_size and entries:
+            used, key, size = entries.pop(0)
+            logger.info("Evicting %s from the result cache"%(key))
+            shutil.rmtree(self.entry(key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,300 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# A pool of boards (devices under test) which top-level suites can be
+# distributed across. The pool is declared in dtest.cfg:
+#
+#   DevicePool:
+#     - { name: board-1, cfg_idx: 0 }
+#     - { name: board-2, cfg_idx: 1 }
+#     - { name: fake-1, fake: true }
+#
+# cfg_idx refers to the DctrlConfigs list. If no DevicePool is given, a
+# device is created for each entry in DctrlConfigs.
+#
+# Entries with 'fake: true' need no DctrlConfigs entry. They make it
+# possible to exercise the scheduler without any hardware.
+#
+# The suite run on a device gets the cfg_idx of the device before its test
+# cases are created (see plan), so also tests produced by a load_test
+# factory run on the leased board. A suite giving cfg_idx itself is only
+# run on a device with that cfg_idx - and is an ERROR if it gives several
+# or the pool has no such device.
+#
+
+import sys
+import Queue
+import logging
+import multiprocessing
+import dtestsuite
+import dtestcase
+import dirs
+
+logger = logging.getLogger("devicepool")
+
+# The device leased by the current (worker) process
+_current = None
+
+def current():
+    """Return the device leased for the suite currently running - or None"""
+    return _current
+
+class Device(object):
+    """
+    A board in the pool, identified by its index in DctrlConfigs. A fake
+    device has no DctrlConfigs entry - nothing is connected to it.
+    """
+
+    def __init__(self, name, cfg_idx=0, config=None, fake=False):
+        self.name = name
+        self.cfg_idx = cfg_idx
+        self.config = config
+        self.fake = fake
+
+    def __str__(self):
+        return self.name
+
+class DevicePool(object):
+    """
+    Keeps track of which devices are free. A device is leased for
+    running a suite and released again when the suite has finished.
+    """
+
+    def __init__(self, devices):
+        if not devices:
+            raise AssertionError("device pool is empty")
+        self.devices = list(devices)
+        self.free = list(devices)
+
+    def lease(self, cfg_idx=None):
+        """Return a free device (with cfg_idx if given) or None if there is none"""
+        for device in self.free:
+            if cfg_idx is None or device.cfg_idx == cfg_idx:
+                self.free.remove(device)
+                logger.debug("leased device %s"%(device))
+                return device
+        return None
+
+    def serves(self, cfg_idx):
+        """True if a device of the pool has cfg_idx"""
+        return any([ device.cfg_idx == cfg_idx for device in self.devices ])
+
+    def release(self, device):
+        if device in self.free or not device in self.devices:
+            raise AssertionError("device %s is not leased"%(device))
+        logger.debug("released device %s"%(device))
+        self.free.append(device)
+
+def load(testsetup):
+    """Create a DevicePool from the DevicePool/DctrlConfigs in the test setup"""
+    configs = getattr(testsetup, 'DctrlConfigs', None) or []
+    entries = getattr(testsetup, 'DevicePool', None)
+    if entries is None:
+        entries = [ {'cfg_idx': i} for i in range(len(configs)) ]
+
+    devices = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise TypeError('DevicePool entries must be dicts')
+        cfg_idx = entry.get('cfg_idx', 0)
+        name = entry.get('name', 'device-%d'%(i))
+        if entry.get('fake', False):
+            devices.append(Device(name, cfg_idx, entry, fake=True))
+            continue
+        if cfg_idx >= len(configs):
+            raise TypeError('DevicePool entry %s refers to missing DctrlConfigs index %d'%(name, cfg_idx))
+        devices.append(Device(name, cfg_idx, configs[cfg_idx]))
+    return DevicePool(devices)
+
+def _pinned(test):
+    """Return the set of cfg_idx values given in the testargs of the tree of test"""
+    found = set()
+    if not isinstance(test, dtestsuite.DtestTestSuite):
+        return found
+    if isinstance(test.testargs, dict) and 'cfg_idx' in test.testargs:
+        found.add(test.testargs['cfg_idx'])
+    # The points of a matrix share its testargs
+    if not test.generated:
+        for child in test._tests:
+            found |= _pinned(child)
+    return found
+
+def _assign_device(test, device):
+    """Give every suite in the tree the cfg_idx of the device"""
+    if not isinstance(test, dtestsuite.DtestTestSuite):
+        return
+    if isinstance(test.testargs, dict):
+        test.testargs['cfg_idx'] = device.cfg_idx
+    if test.generated:
+        # The points of a matrix are assigned when loaded, the rows of
+        # vectors are test cases
+        if hasattr(test, 'preparePoints'):
+            test.preparePoints(lambda name, point: _assign_device(point, device))
+        return
+    for child in test._tests:
+        _assign_device(child, device)
+
+def _run_on_device(queue, index, test, result, context, dirname, device):
+    global _current
+    _current = device
+    _assign_device(test, device)
+    test.testargs['device'] = device.name
+    queue.put((index, dtestsuite.runIsolated(test, result, context, dirname)))
+
+class DeviceScheduler(object):
+    """
+    Runs each of the top-level suites on a device leased from the pool.
+    The suites run in separate processes, so as many suites as there are
+    devices are running at the same time. The outcome of the suites is
+    merged into one result object.
+
+    A worker ending without returning an outcome (crashed in a native
+    driver, killed by the OOM killer, ...) is noticed within poll seconds.
+    Its suite is recorded as ERROR and its device released.
+    """
+
+    poll = 1.0
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def finish(self, result, running, index, outcome):
+        process, device = running.pop(index)
+        process.join()
+        self.pool.release(device)
+        dtestsuite.mergeOutcome(result, outcome)
+
+    def reap(self, result, running, queue, dirnames):
+        """Finish the workers which ended without returning an outcome"""
+        dead = [ index for index, (process, device) in running.items()
+                 if not process.is_alive() ]
+        if not dead:
+            return
+        # Outcomes sent just before the workers ended
+        while True:
+            try:
+                index, outcome = queue.get_nowait()
+            except Queue.Empty:
+                break
+            self.finish(result, running, index, outcome)
+        for index in dead:
+            if not index in running:
+                continue
+            process, device = running[index]
+            if process.exitcode < 0:
+                reason = 'killed by signal %d'%(-process.exitcode)
+            else:
+                reason = 'exit code %d'%(process.exitcode)
+            reason = 'worker running %s on %s ended without an outcome (%s)'%(
+                dirnames[index], device, reason)
+            logger.error(reason)
+            self.finish(result, running, index,
+                        dtestsuite.lostOutcome(dirnames[index], reason))
+
+    def lease(self, pending, pins):
+        """Lease a device for the first pending suite one is free for - (None, None) if none"""
+        for index in pending:
+            device = self.pool.lease(pins[index])
+            if device is not None:
+                pending.remove(index)
+                return index, device
+        return None, None
+
+    def pins(self, result, tests, dirnames, pending):
+        """
+        Return the cfg_idx each of tests must run on (None for any). The
+        suites which can not run on any device are recorded as ERROR and
+        removed from pending.
+        """
+        pins = []
+        for index, test in enumerate(tests):
+            pinned = sorted(_pinned(test))
+            pins.append(pinned[0] if pinned else None)
+            if len(pinned) > 1:
+                reason = '%s gives several cfg_idx (%s)'%(
+                    dirnames[index], ', '.join([ str(i) for i in pinned ]))
+            elif pinned and not self.pool.serves(pinned[0]):
+                reason = '%s gives cfg_idx %s - no device of the pool has it'%(
+                    dirnames[index], pinned[0])
+            else:
+                continue
+            logger.error(reason)
+            pending.remove(index)
+            dtestsuite.mergeOutcome(result, dtestsuite.lostOutcome(dirnames[index], reason))
+        return pins
+
+    def run(self, suite, result, resultDir, tmpDir):
+        if sys.platform.lower().startswith('win'):
+            raise AssertionError("the device pool is not supported on Windows")
+
+        tests = list(suite)
+        context = dtestsuite.RunContext(resultDir, tmpDir)
+        result._testRunEntered = True
+        result.executor = dtestcase.Executor()
+        if getattr(result, 'dirs', None) is None:
+            result.dirs = dirs.DirAllocator()
+
+        dirnames = dtestsuite.reserveDirnames(tests, resultDir, result)
+        # The longest suites first - the pool is busy until the last one ends
+        past = getattr(result, 'history', None)
+        if past is not None:
+            pending = past.longestFirst(tests)
+        else:
+            pending = range(len(tests))
+        pins = self.pins(result, tests, dirnames, pending)
+        running = {}
+        queue = multiprocessing.Queue()
+
+        dtestsuite.flushOutput(result)
+        try:
+            while pending or running:
+                device = None
+                if pending and not result.shouldStop:
+                    index, device = self.lease(pending, pins)
+                if device is not None:
+                    print 'Running %s on %s'%(dirnames[index], device)
+                    dtestsuite.flushOutput(result)
+                    process = multiprocessing.Process(
+                        target=_run_on_device,
+                        args=(queue, index, tests[index], result, context,
+                              dirnames[index], device))
+                    process.start()
+                    running[index] = (process, device)
+                    continue
+
+                if not running:
+                    # Stopped before every suite got a device
+                    break
+
+                try:
+                    index, outcome = queue.get(timeout=self.poll)
+                except Queue.Empty:
+                    self.reap(result, running, queue, dirnames)
+                    continue
+                self.finish(result, running, index, outcome)
+        finally:
+            for process, device in running.values():
+                process.terminate()
+                self.pool.release(device)
+            result.executor.close()
+            result._testRunEntered = False
+
+        return result
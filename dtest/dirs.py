@@ -0,0 +1,87 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Allocation of the result and tmp dirs of a run.
+#
+# Every suite, step and count iteration gets a unique dir name below its
+# parent (name, name-1, name-2, ...). The names are handed out from memory
+# - the result dir of a run is new, so nothing else uses it.
+#
+# The dirs are not created when they are allocated but when they are first
+# used: when a result file is written to them, or when a test accesses its
+# tmpDir/resultDir attribute. Most tmp dirs are never used.
+#
+
+import os
+import errno
+import logging
+
+logger = logging.getLogger("dirs")
+
+def materialize(path):
+    """Create the dir path (and its parents) unless it exists"""
+    # Checked every time - a test may remove its dirs
+    if not path or os.path.isdir(path):
+        return path
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+class DirAllocator(object):
+    """The dir names allocated below each parent dir"""
+
+    def __init__(self):
+        self.taken = set()
+        # (parent, name) -> the next suffix to try
+        self.suffix = {}
+
+    def isTaken(self, path):
+        return os.path.normpath(path) in self.taken
+
+    def claim(self, path):
+        self.taken.add(os.path.normpath(path))
+
+    def allocate(self, parent, name):
+        """Allocate and return a unique dir name below parent based on name"""
+        i = self.suffix.get((parent, name), 0)
+        while True:
+            dirname = name if i == 0 else name + "-" + str(i)
+            i += 1
+            if not self.isTaken(os.path.join(parent, dirname)):
+                break
+        self.suffix[(parent, name)] = i
+        self.claim(os.path.join(parent, dirname))
+        return dirname
+
+    def exists(self, path):
+        """True if path exists or is allocated to a test of the run"""
+        path = os.path.normpath(path)
+        if path in self.taken or os.path.exists(path):
+            return True
+        # The parents of an allocated dir exist as well
+        prefix = path + os.sep
+        for taken in self.taken:
+            if taken.startswith(prefix):
+                return True
+        return False
@@ -18,7 +18,37 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 #
 
+import os
 import unittest
+import dirs
+from multiprocessing.pool import ThreadPool
+
+class Executor(object):
+    """
+    Thread pool shared by all AsyncDtestTestCase's of a run. The pool is
+    created on first use, so runs without asynchronous tests pay nothing.
+    """
+
+    workers = 16
+
+    def __init__(self, workers=None):
+        if workers is not None:
+            self.workers = workers
+        self.pool = None
+        self.pid = None
+
+    def submit(self, func, *args, **kwargs):
+        # Threads do not survive a fork - e.g. into a parallel suite worker
+        if self.pool is None or self.pid != os.getpid():
+            self.pool = ThreadPool(self.workers)
+            self.pid = os.getpid()
+        return self.pool.apply_async(func, args, kwargs)
+
+    def close(self):
+        if self.pool is not None and self.pid == os.getpid():
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
 
 class DtestTestCase(unittest.TestCase):
     """
@@ -29,16 +59,39 @@ class DtestTestCase(unittest.TestCase):
     In case a testcase has to store data to be read by other testcase
     or for e.g. logging, it ought happen in the dir specified by tmpDir.
 
-    The directory is guaranteed to be created before run() is called
-    and it is guaranteed not to be given to other testcases.
+    The directory is guaranteed to exist once the tmpDir attribute is
+    accessed and it is guaranteed not to be given to other testcases.
 
     The class is futher enriched with resultDir attribute.
     The resultDir is stored to be able use it for selftesting of the
     result-directory layout
     """
 
-    tmpDir = ""
-    resultDir = ""
+    _tmpDir = ""
+    _resultDir = ""
+
+    # The dirs.DirAllocator of the run
+    dirs = None
+
+    # The testargs of a cacheable step - see cacheInputs/cacheOutputs
+    cacheSpec = {}
+
+    # The dirs are created on first use (see dirs)
+    @property
+    def tmpDir(self):
+        return dirs.materialize(self._tmpDir)
+
+    @tmpDir.setter
+    def tmpDir(self, value):
+        self._tmpDir = value
+
+    @property
+    def resultDir(self):
+        return dirs.materialize(self._resultDir)
+
+    @resultDir.setter
+    def resultDir(self, value):
+        self._resultDir = value
 
     def fullDescription(self):
         if hasattr(self,'runTest'):
@@ -46,7 +99,64 @@ class DtestTestCase(unittest.TestCase):
         else:
             return self.__doc__
 
+    def cacheInputs(self):
+        """
+        Files and dirs the result of the test depends on. Only used for
+        steps with the cacheable testarg (see dtest.cache). Default is the
+        inputs testarg.
+        """
+        return [ os.path.abspath(p) for p in self.cacheSpec.get('inputs', []) ]
+
+    def cacheOutputs(self):
+        """
+        Files and dirs produced by the test - restored on a cache hit.
+        Default is the outputs testarg or else the tmpDir of the test.
+        """
+        if 'outputs' in self.cacheSpec:
+            return [ os.path.abspath(p) for p in self.cacheSpec['outputs'] ]
+        return [ self.tmpDir ]
+
     def run(self, result=None, tmpDir=None, resultDir=None):
         self.tmpDir = tmpDir
         self.resultDir = resultDir
         super(DtestTestCase, self).run(result)
+
+
+class AsyncDtestTestCase(DtestTestCase):
+    """
+    DtestTestCase for tests mostly waiting on I/O, e.g. polling several
+    boards at once. Work handed to submit() runs in the thread pool owned
+    by the run (the Executor of the top-level DtestTestSuite), so no pool
+    is started per test:
+
+        def runTest(self):
+            pending = [ self.submit(poll, board) for board in self.boards ]
+            for status in self.gather(pending, timeout=30):
+                self.assertEqual(status, 'ready')
+    """
+
+    executor = None
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background. Returns an AsyncResult"""
+        return self.executor.submit(func, *args, **kwargs)
+
+    def gather(self, pending, timeout=None):
+        """
+        Wait for the AsyncResults in pending and return their values.
+        An exception raised by one of the calls is re-raised here.
+        """
+        return [ p.get(timeout) for p in pending ]
+
+    def run(self, result=None, tmpDir=None, resultDir=None):
+        self.executor = getattr(result, 'executor', None)
+        if self.executor is not None:
+            return super(AsyncDtestTestCase, self).run(result, tmpDir, resultDir)
+
+        # Not run by a DtestTestSuite - use a private pool
+        self.executor = Executor()
+        try:
+            return super(AsyncDtestTestCase, self).run(result, tmpDir, resultDir)
+        finally:
+            self.executor.close()
+            self.executor = None
@@ -20,13 +20,29 @@
 
 import unittest
 import os
+import sys
+import copy
 import time
-import yaml
+import traceback
+import itertools
+import multiprocessing
+import StringIO
+import yamlio
 import logging
+import dtestcase
+import usage
+import watchdog
+import history
+import dirs
+import flakes
+import plan
 
 logger = logging.getLogger("dtestSuite")
 
-def logSuiteHeader(test):
+def logSuiteHeader(test, result=None):
+    if result is not None:
+        # Keep the header after the buffered output of the previous tests
+        flushOutput(result)
     if 'name' in test.testargs:
         name = test.testargs['name']
     else:
@@ -39,7 +55,268 @@ def logSuiteHeader(test):
 def _issuite(test):
     return not unittest.suite._isnotsuite(test)
 
-def make_count_result_file(res_dir, name, passed):
+def _isparallelizable(test):
+    """Setup and teardown steps are never run concurrently with siblings"""
+    if not isinstance(test, DtestTestSuite):
+        return False
+    for arg in ('setup', 'teardown'):
+        if arg in test.testargs and test.testargs[arg] is True:
+            return False
+    return True
+
+# Jobs handed to the worker processes of a parallel suite - per batch, as
+# several runs may be going on in the process. The workers are forked, so
+# they inherit the tests without having to pickle them.
+_parallel_jobs = {}
+_parallel_batches = itertools.count()
+_parallel_worker = False
+
+class RunContext(object):
+    """
+    The place of a suite in the run: the result and tmp root dirs of the
+    run and the path (curdir) of the suite below them. A suite is given the
+    context of its parent and hands a child context to its sub-tests, so
+    nothing is shared between runs or the branches of a run.
+    """
+
+    def __init__(self, result_root, tmp_root, curdir=""):
+        self.result_root = result_root
+        self.tmp_root = tmp_root
+        self.curdir = curdir
+
+    def child(self, dirname):
+        return RunContext(self.result_root, self.tmp_root,
+                          os.path.join(self.curdir, dirname))
+
+    @property
+    def resultDir(self):
+        return os.path.join(self.result_root, self.curdir)
+
+    @property
+    def tmpDir(self):
+        return os.path.join(self.tmp_root, self.curdir)
+
+class RemoteTest(object):
+    """
+    Stand-in for a test that was run in a worker process. It is stored in
+    the errors/failures lists of the parent result in place of the real test.
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def __str__(self):
+        return self.name
+
+    def shortDescription(self):
+        return self.description
+
+def flushOutput(result):
+    """
+    Write buffered console and journal output of result. Must be done
+    before forking to avoid the buffers being written by both processes.
+    """
+    reporter = getattr(result, 'reporter', None)
+    if reporter is not None:
+        reporter.flush()
+    sys.stdout.flush()
+    journal = getattr(result, 'journal', None)
+    if journal is not None:
+        journal.flush()
+
+def _run_parallel_job(job):
+    """Entry point of the worker processes of a parallel suite"""
+    global _parallel_worker
+    _parallel_worker = True
+    batch, index = job
+    return runIsolated(*_parallel_jobs[batch][index])
+
+def runIsolated(test, result, context, dirname, header=False):
+    """
+    Run a suite on a clean copy of result and return its outcome as a
+    picklable dict. This is used for running suites in worker processes.
+    dirname is the (unique) directory name reserved for the suite below
+    the RunContext context.
+    """
+    # Start from a clean copy of the parents result object. Only the
+    # outcome of this job is sent back and merged by the parent.
+    result = copy.copy(result)
+    result.testsRun = 0
+    for vector in ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses'):
+        setattr(result, vector, [])
+    result.shouldStop = False
+    if hasattr(result, 'retries'):
+        result.retries = 0
+    result.durations = {}
+    result.outcomes = {}
+
+    reporter = getattr(result, 'reporter', None)
+    if reporter is not None:
+        result.reporter = reporter.isolated()
+
+    test.dirname = dirname
+
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    outcome = {}
+    try:
+        try:
+            if header:
+                logSuiteHeader(test, result)
+            res = test(result, context=context)
+            outcome['failed'] = isinstance(res.passed, DtestTestSuite.TestResultFail)
+        except:
+            outcome['failed'] = True
+            result.errors.append((RemoteTest(dirname, None), traceback.format_exc()))
+    finally:
+        flushOutput(result)
+        outcome['output'] = sys.stdout.getvalue()
+        sys.stdout = stdout
+
+    outcome['testsRun'] = result.testsRun
+    for vector in ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses'):
+        entries = []
+        for entry in getattr(result, vector):
+            # unexpectedSuccesses holds plain tests, the others hold tuples
+            if not isinstance(entry, tuple):
+                entry = (entry,)
+            test = entry[0]
+            if isinstance(test, RemoteTest):
+                description = test.description
+            else:
+                description = test.shortDescription()
+            entries.append((str(test), description) + tuple(entry[1:]))
+        outcome[vector] = entries
+    outcome['shouldStop'] = result.shouldStop
+    outcome['retries'] = getattr(result, 'retries', 0)
+    outcome['durations'] = result.durations
+    outcome['outcomes'] = result.outcomes
+    return outcome
+
+def lostOutcome(dirname, reason):
+    """The outcome of a suite not run to the end - its worker ended or it could not start"""
+    outcome = {'failed': True, 'output': '', 'testsRun': 1,
+               'shouldStop': False, 'retries': 0, 'durations': {}, 'outcomes': {}}
+    for vector in ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses'):
+        outcome[vector] = []
+    outcome['errors'].append((dirname, None, reason))
+    return outcome
+
+def mergeOutcome(result, outcome):
+    """Merge an outcome returned by runIsolated into result"""
+    sys.stdout.write(outcome['output'])
+    sys.stdout.flush()
+    reporter = getattr(result, 'reporter', None)
+    if reporter is not None:
+        reporter.merge(outcome)
+    result.testsRun += outcome['testsRun']
+    for vector in ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses'):
+        entries = getattr(result, vector)
+        for entry in outcome[vector]:
+            remote = RemoteTest(entry[0], entry[1])
+            if vector == 'unexpectedSuccesses':
+                entries.append(remote)
+            else:
+                entries.append((remote,) + tuple(entry[2:]))
+    if outcome['retries']:
+        result.retries = getattr(result, 'retries', 0) + outcome['retries']
+    for key, times in outcome.get('durations', {}).items():
+        if getattr(result, 'durations', None) is None:
+            result.durations = {}
+        result.durations.setdefault(key, []).extend(times)
+    for key, letters in outcome.get('outcomes', {}).items():
+        if getattr(result, 'outcomes', None) is None:
+            result.outcomes = {}
+        result.outcomes.setdefault(key, []).extend(letters)
+    if outcome['shouldStop']:
+        result.stop()
+
+def dirTaken(result, path):
+    """
+    True if the result dir path is used by another test of the run. When
+    resuming a run the existing dirs are reused in the order they are claimed.
+    """
+    resume = getattr(result, 'resume', None)
+    if resume is not None:
+        return resume.isClaimed(path)
+    allocator = getattr(result, 'dirs', None)
+    if allocator is not None:
+        return allocator.isTaken(path)
+    return os.path.exists(path)
+
+def claimDir(result, path):
+    resume = getattr(result, 'resume', None)
+    if resume is not None:
+        resume.claim(path)
+        return
+    allocator = getattr(result, 'dirs', None)
+    if allocator is not None:
+        allocator.claim(path)
+
+def allocateDir(result, parent_dir, name):
+    """Allocate and return a unique dir name below parent_dir for a test named name"""
+    allocator = getattr(result, 'dirs', None)
+    if allocator is not None and getattr(result, 'resume', None) is None:
+        return allocator.allocate(parent_dir, name)
+    dirname = name
+    i = 0
+    while dirTaken(result, os.path.join(parent_dir, dirname)):
+        i += 1
+        dirname = name+"-"+str(i)
+    claimDir(result, os.path.join(parent_dir, dirname))
+    return dirname
+
+def reserveDirnames(tests, parent_dir, result=None):
+    """
+    Return a list of unique directory names for tests below parent_dir.
+    Used when the tests are about to run concurrently and thus can not
+    see which names their siblings are about to use.
+    """
+    taken = set()
+    dirnames = []
+    for test in tests:
+        dirname = test.dirname
+        i = 0
+        while (dirname in taken or
+               dirTaken(result, os.path.join(parent_dir, dirname))):
+            i += 1
+            dirname = test.dirname+"-"+str(i)
+        taken.add(dirname)
+        dirnames.append(dirname)
+    return dirnames
+
+def replayResults(result, resume, res_dir):
+    """
+    Account the results of the steps of the finished test in res_dir of a
+    resumed run into result. Returns True if the test passed.
+    """
+    outcome = {'output': '', 'testsRun': 0, 'shouldStop': False, 'retries': 0}
+    for vector in ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses'):
+        outcome[vector] = []
+    for path, res in resume.steps(res_dir):
+        outcome['testsRun'] += 1
+        name = res.get('name', path)
+        description = res.get('description')
+        if res['result'] == 'FAIL':
+            outcome['failures'].append((name, description, 'FAIL in the resumed run'))
+        elif res['result'] == 'ERROR':
+            outcome['errors'].append((name, description, 'ERROR in the resumed run'))
+        elif res['result'] == 'SKIP':
+            outcome['skipped'].append((name, description, 'SKIP in the resumed run'))
+    mergeOutcome(result, outcome)
+    return resume.get(res_dir)['result'] in ('PASS', 'SKIP')
+
+def invalidateShared(result, reason):
+    shared = getattr(result, 'shared', None)
+    if shared is not None:
+        shared.invalidate(reason)
+
+def make_count_result_file(res_dir, name, passed, journal=None):
     resDict = {}
     resDict['type'] = 'count_or_retry'
     resDict['name'] = name
@@ -49,9 +326,14 @@ def make_count_result_file(res_dir, name, passed):
     else:
         resDict['result'] = 'FAIL'
 
+    if journal is not None:
+        journal.append(res_dir, 'count', resDict)
+        return
+
     try:
+        dirs.materialize(res_dir)
         with open(os.path.join(res_dir, 'result.yaml'), 'w') as f:
-            yaml.dump(resDict, f, explicit_start=True)
+            yamlio.dump(resDict, f, explicit_start=True)
     except:
         print 'Error writing count result yaml: %s'%res_dir
 
@@ -66,17 +348,23 @@ class DtestTestSuite(unittest.TestSuite):
     The DtestTestSuite overrides the parents recursive suite handling
     such that the tmpDir attribute in DtestTestCase is handled properly.
 
-    The run() method thus takes care of creating the unique tmpDir before
+    The run() method thus takes care of allocating the unique tmpDir before
     executing a testcase (or a nested testsuite)
 
-    DtestTestSuite further more ensures a unique result dir is created for
+    DtestTestSuite further more ensures a unique result dir is allocated for
     each test case. This dir is saved into the result object (ResultClass)
     such that results are saved in a unique directory for each test case
     """
 
-    curdir = ""
-    tmp_root = ""
-    result_root = ""
+    # The name and params the suite was loaded by (see history)
+    loadname = None
+    loadparams = None
+
+    # True if the sub-tests are generated when the suite runs (see matrix
+    # and vectors) rather than loaded up front. Such a suite has no _tests
+    # and iterating it loads every sub-test - code walking the tree before
+    # the run must handle it explicitly
+    generated = False
 
     class TestResult:
         """Class to subclass test result types from"""
@@ -97,7 +385,13 @@ class DtestTestSuite(unittest.TestSuite):
         super(DtestTestSuite, self).__init__(tests)
 
 
-    def suiteRun(self, result, tmpDir, debug=False):
+    def countTestCases(self):
+        cases = super(DtestTestSuite, self).countTestCases()
+        if 'count' in self.testargs:
+            cases *= self.testargs['count']
+        return cases
+
+    def suiteRun(self, result, context, debug=False):
         """Execute all sub-steps in a test. Returns TRUE if no errors
            Raises exception if error and exit-on-error is set
         """
@@ -107,22 +401,40 @@ class DtestTestSuite(unittest.TestSuite):
         errorFree = True
 
         if 'header' in self.testargs:
-            logSuiteHeader(self)
+            logSuiteHeader(self, result)
+
+        parallel = self.parallelWorkers()
+        batch = []
 
         for test in self:
             if result.shouldStop:
                 break
 
-            if errorExit:
-                # proceed to teardown steps
-                if not 'teardown' in test.testargs or not test.testargs['teardown'] is True:
-                    continue
-
             # Up front catch of invalid settings
             if 'exit-on-error' in self.testargs:
                 if not self.testargs['exit-on-error']:
                     raise AttributeError('Only valid value of exit-on-error is true')
 
+            # Collect siblings which may run concurrently. The batch is
+            # flushed before any setup/teardown step to keep their ordering.
+            if parallel > 1 and _isparallelizable(test):
+                if not errorExit:
+                    batch.append(test)
+                continue
+
+            if batch:
+                for failed, child in self.parallelRun(batch, result, context, parallel):
+                    if failed:
+                        errorFree = False
+                        errorExit = self.checkErrorExit(child) or errorExit
+                batch = []
+                invalidateShared(result, "concurrent suites have run")
+
+            if errorExit:
+                # proceed to teardown steps
+                if not 'teardown' in test.testargs or not test.testargs['teardown'] is True:
+                    continue
+
             if unittest.suite._isnotsuite(test):
                 self._tearDownPreviousClass(test, result)
                 self._handleModuleFixture(test, result)
@@ -135,11 +447,10 @@ class DtestTestSuite(unittest.TestSuite):
 
             if 'header' in self.testargs:
                 if not 'header' in test.testargs:
-                    logSuiteHeader(test)
-
+                    logSuiteHeader(test, result)
 
             if not debug:
-                res = test(result, tmpDir=tmpDir,resultDir=result.result_dir)
+                res = self.runStep(test, result, context)
             else:
                 res = test.debug()
 
@@ -154,17 +465,18 @@ class DtestTestSuite(unittest.TestSuite):
 
             if test_failed:
                 errorFree = False
+                errorExit = self.checkErrorExit(test) or errorExit
 
-                # Check for configured exit on error
-                if 'exit-on-error' in self.testargs:
-                    errorExit=True
-                # Automatic exit-on-error if error in setup tests
-                if hasattr(self,'testargs'):
-                    if 'setup' in self.testargs and self.testargs['setup'] is True:
-                        errorExit=True
-                if hasattr(test,'testargs'):
-                    if 'setup' in test.testargs and test.testargs['setup'] is True:
-                        errorExit=True
+            shared = getattr(result, 'shared', None)
+            if shared is not None:
+                shared.stepDone(test, test_failed)
+
+        if batch and not result.shouldStop:
+            for failed, child in self.parallelRun(batch, result, context, parallel):
+                if failed:
+                    errorFree = False
+                    errorExit = self.checkErrorExit(child) or errorExit
+            invalidateShared(result, "concurrent suites have run")
 
         # Now that all teardowns have been processed we can raise execption
         if errorExit:
@@ -172,16 +484,145 @@ class DtestTestSuite(unittest.TestSuite):
 
         return errorFree
 
+    def stepTimeout(self, result):
+        """Return the timeout of the steps of this suite - None if unbounded"""
+        if 'timeout' in self.testargs:
+            return self.testargs['timeout']
+        return getattr(result, 'timeout', None)
+
+    def runStep(self, test, result, context):
+        """Run a sub-test. Test cases are interrupted by a watchdog on timeout"""
+        if not unittest.suite._isnotsuite(test):
+            return test(result, context=context)
+        if isinstance(test, dtestcase.DtestTestCase):
+            # The dirs are created when the test uses them
+            test.dirs = getattr(result, 'dirs', None)
+        else:
+            dirs.materialize(context.tmpDir)
+            dirs.materialize(context.resultDir)
+            # Other test cases have their results written to the current dir
+            result.result_dir = context.resultDir
+        cache = getattr(result, 'cache', None)
+        if (cache is not None and 'cacheable' in self.testargs and
+            self.testargs['cacheable'] and isinstance(test, dtestcase.DtestTestCase)):
+            return self.runCached(test, result, context, cache)
+        return self.runWatched(test, result, context)
+
+    def runCached(self, test, result, context, cache):
+        """Run a cacheable step - or restore its outputs from the cache"""
+        test.tmpDir = context.tmpDir
+        test.resultDir = context.resultDir
+        test.cacheSpec = self.testargs
+        key = cache.key(test, self)
+        entry = cache.restore(key, test)
+        if entry is not None:
+            if 'output' in entry:
+                test.output = entry['output']
+            result.startTest(test)
+            result.addCached(test, key)
+            result.stopTest(test)
+            return
+
+        vectors = ('failures', 'errors', 'skipped',
+                   'expectedFailures', 'unexpectedSuccesses')
+        before = [ len(getattr(result, vector)) for vector in vectors ]
+        self.runWatched(test, result, context)
+        if before == [ len(getattr(result, vector)) for vector in vectors ]:
+            record = {}
+            if hasattr(test, 'output'):
+                record['output'] = test.output
+            cache.store(key, test, record)
+
+    def runWatched(self, test, result, context):
+        """Run a test case with its code interrupted by the watchdog on timeout"""
+        with watchdog.StepWatch(test, self.stepTimeout(result)):
+            return test(result, tmpDir=context.tmpDir, resultDir=context.resultDir)
+
+    def checkErrorExit(self, test):
+        """Returns True if a failure of test must make the suite bail out"""
+        # Check for configured exit on error
+        if 'exit-on-error' in self.testargs:
+            return True
+        # Automatic exit-on-error if error in setup tests
+        if hasattr(self,'testargs'):
+            if 'setup' in self.testargs and self.testargs['setup'] is True:
+                return True
+        if hasattr(test,'testargs'):
+            if 'setup' in test.testargs and test.testargs['setup'] is True:
+                return True
+        return False
+
+    def parallelWorkers(self):
+        """Number of sibling suites allowed to run concurrently"""
+        if not 'parallel' in self.testargs:
+            return 1
+        if _parallel_worker:
+            # Nested parallel suites are run sequentially inside a worker
+            return 1
+        if sys.platform.lower().startswith('win'):
+            logger.warning("parallel is not supported on Windows - running sequentially")
+            return 1
+        return self.testargs['parallel']
+
+    def parallelRun(self, tests, result, context, workers):
+        """
+        Run the sibling suites in tests in a pool of worker processes.
+        Each worker is assigned its own unique result/tmp dir up front. The
+        outcome of every worker is merged back into result and the output
+        of the workers is printed in the order of the tests.
+        Returns a list of (failed, test) tuples.
+        """
+        jobs = []
+        dirnames = reserveDirnames(tests, context.resultDir, result)
+        for test, dirname in zip(tests, dirnames):
+            header = 'header' in self.testargs and not 'header' in test.testargs
+            jobs.append((test, result, context, dirname, header))
+
+        # Start the longest suites first to shorten the total run time
+        past = getattr(result, 'history', None)
+        if past is not None:
+            order = past.longestFirst(tests)
+        else:
+            order = range(len(tests))
+
+        logger.debug("Running %d suites using %d workers"%(len(jobs), workers))
+
+        flushOutput(result)
+
+        batch = next(_parallel_batches)
+        _parallel_jobs[batch] = [ jobs[i] for i in order ]
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        status = []
+        try:
+            outcomes = pool.imap(_run_parallel_job,
+                                 [ (batch, i) for i in range(len(jobs)) ])
+            for i, outcome in zip(order, outcomes):
+                mergeOutcome(result, outcome)
+                status.append((outcome['failed'], tests[i]))
+        finally:
+            pool.close()
+            pool.join()
+            del _parallel_jobs[batch]
+            # The workers claimed the dirs in their own copy of the run
+            for dirname in dirnames:
+                claimDir(result, os.path.join(context.resultDir, dirname))
+
+        return status
+
     # This method is a complete override of TestSuite.run
-    def run(self, result, debug=False, resultDir=None, tmpDir=None):
+    def run(self, result, debug=False, resultDir=None, tmpDir=None, context=None):
         topLevel = False
         if getattr(result, '_testRunEntered', False) is False:
             result._testRunEntered = topLevel = True
-            logger.debug("Setting result_root as %s"%(resultDir))
-            DtestTestSuite.result_root = resultDir
-            DtestTestSuite.tmp_root = tmpDir
+            # Thread pool shared by the asynchronous tests of the run
+            result.executor = dtestcase.Executor()
+            if getattr(result, 'dirs', None) is None:
+                result.dirs = dirs.DirAllocator()
 
-        path = DtestTestSuite.curdir
+        if context is None:
+            # The top-level suite is placed directly in the dirs of the run
+            logger.debug("Setting result_root as %s"%(resultDir))
+            context = RunContext(resultDir, tmpDir)
 
         # Exstract the count variable - used to repeat a test
         if 'count' in self.testargs:
@@ -195,40 +636,49 @@ class DtestTestSuite(unittest.TestSuite):
         else:
             retry=1
 
-        logger.debug("Result dir input is: %s"%(resultDir))
-        logger.debug("Tmp dir input is: %s"%(tmpDir))
+        # Known flaky tests are retried, stable tests fail fast
+        quarantined = False
+        flakedb = getattr(result, 'flakes', None)
+        if flakedb is not None and not 'count' in self.testargs:
+            quarantined = flakedb.quarantine and flakedb.isQuarantined(self)
+            retry = flakedb.retries(self, retry)
 
         # allow the same test case to be run multiple times in one suite
-        # Generate unique dir name - based if the result dir already exists
-        # Afterwards modify the curdir to match that new directory
-        # NOTE: The curdir may be altered again further down in case the
-        # test has to be repeated (count > 1)
-
-        # Base the new directory name on the test name
-        new_dir = self.dirname
-        # Default is to place the directory in the root + the current path + new_dir
-        new_abs_result_path=os.path.join(DtestTestSuite.result_root,path,new_dir)
-        i=0
-        while(os.path.exists(new_abs_result_path)):
-            # Append a number and retry
-            i+=1
-            logger.debug("new_abs_result_path already existed %s"%(new_abs_result_path))
-            new_dir = self.dirname+"-"+str(i)
-            new_abs_result_path=os.path.join(DtestTestSuite.result_root,path, new_dir)
-
-        DtestTestSuite.curdir = os.path.join(path, new_dir)
-        logger.debug("Setting DtestTestSuite.curdir to %s"%(DtestTestSuite.curdir))
-
-        result.result_dir= os.path.join(DtestTestSuite.result_root, DtestTestSuite.curdir)
-        tmpDir = os.path.join(DtestTestSuite.tmp_root, DtestTestSuite.curdir)
+        # Generate unique dir name - based on the names already allocated
+        # The context of the suite is the context of its parent extended with
+        # that new directory
+        # NOTE: Repeated tests (count > 1) get a further dir per iteration
+        new_dir = allocateDir(result, context.resultDir, self.dirname)
+        context = context.child(new_dir)
 
         # When coming here result_dir is unique.
-        base_result_dir = result.result_dir
-        base_tmp_dir = tmpDir
+        base_result_dir = context.resultDir
 
-        logger.debug("Result dir is: %s"%(result.result_dir))
-        logger.debug("base_tmp_dir is: %s"%(base_tmp_dir))
+        logger.debug("Result dir is: %s"%(base_result_dir))
+        logger.debug("base_tmp_dir is: %s"%(context.tmpDir))
 
+        resume = getattr(result, 'resume', None)
+        if resume is not None and resume.isComplete(base_result_dir):
+            # Finished before the resumed run was interrupted
+            logger.info("Skipping finished %s"%(base_result_dir))
+            if replayResults(result, resume, base_result_dir):
+                final_result = self.TestResultPass()
+            else:
+                final_result = self.TestResultFail()
+            if topLevel:
+                self.finishRun(result)
+            result.passed = final_result
+            return result
+
+        shared = getattr(result, 'shared', None)
+        if shared is not None and 'shared' in self.testargs:
+            origin = shared.lookup(self)
+            if origin is not None:
+                self.reuseShared(result, origin, base_result_dir)
+                if topLevel:
+                    self.finishRun(result)
+                result.passed = self.TestResultPass()
+                return result
 
         pre_errors = len(result.errors)
         pre_failures = len(result.failures)
@@ -245,35 +695,47 @@ class DtestTestSuite(unittest.TestSuite):
 
         # Store the start time of the test suite
         start_time=time.time()
+        start_usage = usage.snapshot()
+
+        # Create the test cases planned by the loader - for this run only
+        planned = self._tests
+        if plan.planned(planned):
+            self._tests = plan.create(planned)
 
         try:
-            # backup the curdir.
-            # "DtestTestSuite.curdir" is modified if the test uses "count"
-            org_curdir =  DtestTestSuite.curdir
             for i in xrange(0,count):
                 logger.debug("Loop number %s"%(i))
 
                 if count == 1:
                     # don't make separate dirs
                     extra_dirname = ""
+                    iteration = context
                 else:
                     extra_dirname = os.sep + "run-%d"%(i+1)
-
-                result.result_dir = base_result_dir + extra_dirname
-                tmpDir = base_tmp_dir + extra_dirname
-                DtestTestSuite.curdir  = org_curdir + extra_dirname
-
-                os.makedirs(result.result_dir)
-                os.makedirs(tmpDir)
+                    iteration = context.child("run-%d"%(i+1))
+
+                if resume is not None:
+                    if count > 1 and resume.isComplete(iteration.resultDir):
+                        # Iteration finished before the run was interrupted
+                        retry_attempts += 1
+                        res = replayResults(result, resume, iteration.resultDir)
+                        if not res:
+                            final_result = self.TestResultFail()
+                        if retry > 1:
+                            if res:
+                                final_result = self.TestResultPass()
+                                break
+                            result.retries += 1
+                        continue
 
                 try:
                     pre_runcnt = result.testsRun
                     retry_attempts +=1
-                    res = self.suiteRun(result, tmpDir, debug)
+                    res = self.suiteRun(result, iteration, debug)
 
                     if count > 1:
-                        res_dir = base_result_dir + extra_dirname
-                        make_count_result_file(res_dir, extra_dirname, res)
+                        make_count_result_file(iteration.resultDir, extra_dirname, res,
+                                               journal=getattr(result, 'journal', None))
 
                     if not res:
                         final_result = self.TestResultFail()
@@ -291,6 +753,7 @@ class DtestTestSuite(unittest.TestSuite):
                             break;
                         else:
                             result.retries += 1
+                            flushOutput(result)
                             if i < retry-1:
                                 print '************** RETRYING ***************'
                             else:
@@ -301,23 +764,64 @@ class DtestTestSuite(unittest.TestSuite):
 
         except ErrorExitException:
             final_result = self.TestResultFail()
+            flushOutput(result)
             print 'Testsuite %s aborted'%(self.dirname)
+        finally:
+            # Also when interrupted - the next run creates its own test cases
+            self._tests = planned
+
+        self.updateResultFile(base_result_dir, final_result, start_time, retry, retry_attempts,
+                              journal=getattr(result, 'journal', None),
+                              suite_usage=usage.delta(start_usage),
+                              quarantined=quarantined)
+        history.record(result, self, time.time() - start_time)
+        if isinstance(final_result, self.TestResultFail):
+            flakes.record(result, self, 'F')
+        elif isinstance(final_result, self.TestResultPass):
+            if retry > 1 and retry_attempts > 1:
+                flakes.record(result, self, 'R')
+            else:
+                flakes.record(result, self, 'P')
+        if (shared is not None and 'shared' in self.testargs and
+            isinstance(final_result, self.TestResultPass)):
+            shared.record(self, context.curdir)
 
-        self.updateResultFile(base_result_dir, final_result, start_time, retry, retry_attempts)
-
-        logger.debug("Setting curdir back to path: %s"%(path))
-        DtestTestSuite.curdir = path
         if topLevel:
-            self._tearDownPreviousClass(None, result)
-            self._handleModuleTearDown(result)
-            result._testRunEntered = False
+            self.finishRun(result)
         result.passed = final_result
         return result
 
-
-    def updateResultFile(self, res_dir, final_result, start_time, retry_max=0, count=1):
-        if os.path.exists(os.path.join(res_dir, 'result.yaml')):
-            resDict = yaml.load(file(os.path.join(res_dir, 'result.yaml'),'r'))
+    def reuseShared(self, result, origin, res_dir):
+        """Account the shared setup run in origin in place of running it again"""
+        logger.info("Reusing shared setup %s of %s"%(self.dirname, origin))
+        outcome = {'output': '', 'testsRun': self.countTestCases(),
+                   'shouldStop': False, 'retries': 0}
+        for vector in ('failures', 'errors', 'skipped',
+                       'expectedFailures', 'unexpectedSuccesses'):
+            outcome[vector] = []
+        mergeOutcome(result, outcome)
+        self.updateResultFile(res_dir, self.TestResultPass(), time.time(),
+                              journal=getattr(result, 'journal', None),
+                              shared=origin)
+
+    def finishRun(self, result):
+        """Clean up after the top-level suite of the run"""
+        self._tearDownPreviousClass(None, result)
+        self._handleModuleTearDown(result)
+        result._testRunEntered = False
+        result.executor.close()
+
+
+    def resultDetails(self, res_dir):
+        """Return further entries of the result file of the run in res_dir"""
+        return {}
+
+    def updateResultFile(self, res_dir, final_result, start_time, retry_max=0, count=1,
+                         journal=None, suite_usage=None, shared=None, quarantined=False):
+        if journal is not None:
+            resDict = journal.take(res_dir)
+        elif os.path.exists(os.path.join(res_dir, 'result.yaml')):
+            resDict = yamlio.load_file(os.path.join(res_dir, 'result.yaml'))
         else:
             resDict = {}
 
@@ -348,6 +852,18 @@ class DtestTestSuite(unittest.TestSuite):
         if 'flag' in self.testargs:
             resDict['flag'] = self.testargs['flag']
 
+        if 'device' in self.testargs:
+            resDict['device'] = self.testargs['device']
+
+        # Not run - the result of the shared setup run in this dir is reused
+        if shared is not None:
+            resDict['shared'] = shared
+
+        # The resource usage of the entire suite - replaces the usage of the
+        # step in case the suite is a single test case
+        if suite_usage is not None:
+            resDict['usage'] = suite_usage
+
         if not 'result' in resDict:
             resDict['result'] = final_result.result_text
 
@@ -355,13 +871,23 @@ class DtestTestSuite(unittest.TestSuite):
             logger.debug("Test has a count argument (%s)"%(self.testargs['count']))
             resDict['count'] = self.testargs['count']
 
-        if 'retry' in self.testargs:
-            resDict['retry-max'] = self.testargs['retry']
+        if retry_max > 1:
+            resDict['retry-max'] = retry_max
             resDict['retries'] = count
 
+        if quarantined:
+            resDict['quarantined'] = True
+
+        resDict.update(self.resultDetails(res_dir))
+
+        if journal is not None:
+            journal.append(res_dir, 'suite', resDict)
+            return
+
         try:
+            dirs.materialize(res_dir)
             with open(os.path.join(res_dir, 'result.yaml'), 'w') as f:
-                yaml.dump(resDict, f, explicit_start=True)
+                yamlio.dump(resDict, f, explicit_start=True)
         except:
             print 'Error writing result.yaml for suite'
 
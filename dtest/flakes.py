@@ -0,0 +1,189 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Tracking of flaky tests across runs.
+#
+# The outcome of every suite/step of a run is recorded in a JSON file
+# (FLAKE_FILE in the test home by default), keyed like the duration history
+# (see history). Each test has the sequence of its outcomes of the latest
+# runs, one letter per run:
+#
+#   P  passed (every time it was run)
+#   F  failed (every time it was run)
+#   R  both - it failed and passed in the same run, e.g. passed on a retry
+#
+# The flake rate of a test is the share of its runs that were R or where
+# the outcome flipped between P and F since the previous run.
+#
+# With the quarantine policy a test with a flake rate of at least the
+# threshold is quarantined: it is retried automatically, while the retry
+# testarg of tests known to be stable is ignored, so they fail fast. Tests
+# with fewer than min_runs runs keep their retry testarg.
+# Only the innermost flaky tests are quarantined - a suite is not retried
+# as a whole because one of its steps is flaky.
+#
+
+import os
+import json
+import logging
+import history
+import statefile
+
+logger = logging.getLogger("flakes")
+
+FLAKE_FILE = os.path.join(".dtest", "flakes.json")
+
+# The number of runs kept per test
+KEEP_RUNS = 30
+
+def outcome(outcomes):
+    """Return the letter of a run of a test from its outcomes (P/F/R) in the run"""
+    if all([ o == 'P' for o in outcomes ]):
+        return 'P'
+    if all([ o == 'F' for o in outcomes ]):
+        return 'F'
+    return 'R'
+
+def flakeRate(sequence):
+    """Return the flake rate of a sequence of run outcomes"""
+    if not sequence:
+        return 0.0
+    flaky = sequence.count('R')
+    verdicts = [ o for o in sequence if o != 'R' ]
+    for previous, current in zip(verdicts, verdicts[1:]):
+        if previous != current:
+            flaky += 1
+    return float(flaky) / len(sequence)
+
+class FlakeDB(object):
+    """
+    The outcomes of the tests of previous runs - and the quarantine policy
+    derived from them.
+    """
+
+    def __init__(self, filename=FLAKE_FILE, quarantine=False, threshold=0.1,
+                 retry=3, min_runs=3):
+        self.filename = filename
+        self.quarantine = quarantine
+        self.threshold = threshold
+        self.retry = retry
+        self.min_runs = min_runs
+        self.tests = {}
+        # The outcomes added since loading - merged into the file on save
+        self.added = []
+
+    @classmethod
+    def load(cls, filename=FLAKE_FILE, **policy):
+        db = cls(filename, **policy)
+        db.tests = statefile.load_json(filename, 'flake database') or {}
+        return db
+
+    def update(self, outcomes):
+        """Add the outcomes (a dict key -> list of P/F/R) of a run"""
+        self.added.append(outcomes)
+        self._add(self.tests, outcomes)
+
+    def _add(self, tests, outcomes):
+        for key, run in outcomes.items():
+            entry = tests.setdefault(key, {'runs': 0, 'sequence': ''})
+            entry['runs'] += 1
+            entry['sequence'] = (entry['sequence'] + outcome(run))[-KEEP_RUNS:]
+
+    def save(self):
+        """Merge the outcomes added into the file - as saved by other runs meanwhile"""
+        if self.filename is None:
+            return
+        try:
+            with statefile.locked(self.filename):
+                tests = statefile.load_json(self.filename, 'flake database') or {}
+                for outcomes in self.added:
+                    self._add(tests, outcomes)
+                statefile.replace(self.filename,
+                                  lambda f: json.dump(tests, f, sort_keys=True, indent=0))
+        except (IOError, OSError, TypeError, ValueError), e:
+            logger.warning("Could not save the flake database %s: %s"%(self.filename, e))
+            return
+        self.tests = tests
+        self.added = []
+
+    def rate(self, key):
+        """Return the flake rate of key - None if it has too few runs"""
+        entry = self.tests.get(key)
+        if entry is None or len(entry['sequence']) < self.min_runs:
+            return None
+        return flakeRate(entry['sequence'])
+
+    def isFlaky(self, test):
+        k = history.testKey(test)
+        if k is None:
+            return False
+        rate = self.rate(k)
+        return rate is not None and rate >= self.threshold
+
+    def isQuarantined(self, test):
+        """True if test is flaky and none of the suites below it are"""
+        if not self.isFlaky(test):
+            return False
+        return not self._flakyBelow(test)
+
+    def _flakyBelow(self, test):
+        if getattr(test, 'generated', False):
+            # Not loaded before they run: the points of a matrix are
+            # quarantined on their own, the rows of vectors are test cases
+            return hasattr(test, 'selectPoints')
+        for child in getattr(test, '_tests', []):
+            if hasattr(child, '_tests'):
+                if self.isFlaky(child) or self._flakyBelow(child):
+                    return True
+        return False
+
+    def retries(self, test, retry):
+        """Return the number of attempts of test given its retry testarg"""
+        if not self.quarantine:
+            return retry
+        if self.isQuarantined(test):
+            return max(retry, self.retry)
+        k = history.testKey(test)
+        if k is None or self.rate(k) is None:
+            # Too few runs to tell - keep the retry testarg
+            return retry
+        # Stable tests fail fast
+        return 1
+
+    def flaky(self):
+        """Return a list of (rate, key, sequence) of the flaky tests - most flaky first"""
+        found = []
+        for key in self.tests:
+            rate = self.rate(key)
+            if rate is not None and rate >= self.threshold:
+                found.append((rate, key, self.tests[key]['sequence']))
+        found.sort(key=lambda entry: (-entry[0], entry[1]))
+        return found
+
+def record(result, test, letter):
+    """Record an outcome (P/F/R) of a suite run in result - added to the database at the end"""
+    k = history.testKey(test)
+    if k is None:
+        return
+    outcomes = getattr(result, 'outcomes', None)
+    if outcomes is None:
+        outcomes = result.outcomes = {}
+    outcomes.setdefault(k, []).append(letter)
@@ -0,0 +1,158 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# History of the durations of the tests of previous runs. Each suite/step
+# run is timed and the history is updated at the end of the run. A test is
+# identified by the name it was loaded by plus a hash of its params:
+#
+#   dtest.linux.cmd:3f2a9c01d4e5
+#
+# The history is a JSON file (HISTORY_FILE in the test home by default)
+# holding a moving average of the duration of each test. It is used to
+# run the longest of the concurrent suites first, and for estimating the
+# remaining time of the run.
+#
+
+import os
+import json
+import hashlib
+import logging
+import statefile
+
+logger = logging.getLogger("history")
+
+HISTORY_FILE = os.path.join(".dtest", "durations.json")
+
+def key(name, params=None):
+    """Return the history key of a test loaded by name with params"""
+    digest = hashlib.sha1(json.dumps(params or {}, sort_keys=True, default=str))
+    return '%s:%s'%(name, digest.hexdigest()[:12])
+
+def testKey(test):
+    """Return the history key of a loaded suite - None if it has no load name"""
+    name = getattr(test, 'loadname', None)
+    if name is None:
+        return None
+    return key(name, getattr(test, 'loadparams', None))
+
+class DurationHistory(object):
+    """
+    The durations of previous runs. Durations are averaged with an
+    exponential moving average weighting the latest run by alpha.
+    """
+
+    alpha = 0.3
+
+    def __init__(self, filename=HISTORY_FILE):
+        self.filename = filename
+        self.durations = {}
+        # The durations added since loading - merged into the file on save
+        self.added = []
+
+    @classmethod
+    def load(cls, filename=HISTORY_FILE):
+        history = cls(filename)
+        history.durations = statefile.load_json(filename, 'duration history') or {}
+        return history
+
+    def get(self, key):
+        """Return the expected duration of key - None if unknown"""
+        entry = self.durations.get(key)
+        if entry is None:
+            return None
+        return entry['mean']
+
+    def update(self, durations):
+        """Add the durations (a dict key -> list of seconds) of a run"""
+        self.added.append(durations)
+        self._add(self.durations, durations)
+
+    def _add(self, stored, durations):
+        for key, times in durations.items():
+            for seconds in times:
+                entry = stored.get(key)
+                if entry is None:
+                    stored[key] = {'mean': seconds, 'runs': 1}
+                else:
+                    entry['mean'] += self.alpha * (seconds - entry['mean'])
+                    entry['runs'] += 1
+
+    def save(self):
+        """Merge the durations added into the file - as saved by other runs meanwhile"""
+        if self.filename is None:
+            return
+        try:
+            with statefile.locked(self.filename):
+                stored = statefile.load_json(self.filename, 'duration history') or {}
+                for durations in self.added:
+                    self._add(stored, durations)
+                statefile.replace(self.filename,
+                                  lambda f: json.dump(stored, f, sort_keys=True, indent=0))
+        except (IOError, OSError, TypeError, ValueError), e:
+            logger.warning("Could not save the duration history %s: %s"%(self.filename, e))
+            return
+        self.durations = stored
+        self.added = []
+
+    def estimate(self, test):
+        """
+        Return the expected duration of test. Unknown suites are estimated
+        from their children - except generated suites (matrix, vectors),
+        whose tests are not loaded before they run. None if nothing is
+        known about the test.
+        """
+        k = testKey(test)
+        if k is not None and k in self.durations:
+            return self.durations[k]['mean']
+        if getattr(test, 'generated', False):
+            return None
+        children = [ child for child in getattr(test, '_tests', [])
+                     if hasattr(child, '_tests') ]
+        if not children:
+            return None
+        estimates = [ self.estimate(child) for child in children ]
+        if None in estimates:
+            return None
+        testargs = getattr(test, 'testargs', None) or {}
+        total = sum(estimates)
+        if testargs.get('parallel', 1) > 1:
+            total = max(max(estimates), total / testargs['parallel'])
+        return total * testargs.get('count', 1)
+
+    def longestFirst(self, tests):
+        """Return the indices of tests ordered by expected duration - longest first"""
+        estimates = [ self.estimate(test) for test in tests ]
+        known = [ e for e in estimates if e is not None ]
+        # Tests never run before are assumed to take an average time
+        default = sum(known) / len(known) if known else 0.0
+        order = range(len(tests))
+        order.sort(key=lambda i: -(estimates[i] if estimates[i] is not None else default))
+        return order
+
+def record(result, test, seconds):
+    """Record the duration of a suite run in result - added to the history at the end"""
+    k = testKey(test)
+    if k is None:
+        return
+    durations = getattr(result, 'durations', None)
+    if durations is None:
+        durations = result.durations = {}
+    durations.setdefault(k, []).append(seconds)
@@ -0,0 +1,157 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# An append-only journal of the results of a test run. Instead of writing
+# (and re-reading) a result.yaml file for every step and suite, each result
+# is appended as one JSON line to a single file in the result dir:
+#
+#   {"path": "mysuite/mytest", "kind": "suite", "result": {...}}
+#
+# path is relative to the result dir of the run. kind is one of:
+#
+#   suite:  replaces the result.yaml of path (written by DtestTestSuite)
+#   count:  replaces the result.yaml of a count/retry iteration
+#   step:   appended to the result.yaml of path
+#
+# The result of a step (written by DTestResult) is not journaled itself but
+# kept until the suite wrapping the step merges it into its own record, so
+# each step has one record. Step results no suite has taken are written as
+# step records when the journal is closed.
+#
+# The records are written in batches and fsync'ed once per batch. The
+# usual result.yaml tree can be generated from the journal with export().
+#
+
+import os
+import json
+import time
+import logging
+import yamlio
+
+logger = logging.getLogger("journal")
+
+JOURNAL_FILE = "journal.jsonl"
+
+class Journal(object):
+    """
+    Append-only journal of the results written during a run.
+    Records are buffered and written (and fsync'ed) when batch_size records
+    are pending or sync_interval seconds have passed since the last write.
+    """
+
+    def __init__(self, root, batch_size=100, sync_interval=1.0):
+        self.root = root
+        self.filename = os.path.join(root, JOURNAL_FILE)
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.buffer = []
+        self.last_sync = time.time()
+        # The step results written to each path. The latest is what a
+        # suite merges its own result into when the suite has finished.
+        self.pending = {}
+        # Written with os.write on an O_APPEND descriptor. Each batch holds
+        # complete lines only, so processes sharing the journal (parallel
+        # suites) never interleave partial records.
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.root)
+
+    def append(self, path, kind, resDict):
+        path = self.relpath(path)
+        if kind == 'step':
+            # Journaled with the result of the suite
+            self.pending.setdefault(path, []).append(resDict)
+            return
+        self.pending.pop(path, None)
+        self.write(path, kind, resDict)
+
+    def write(self, path, kind, resDict):
+        record = {'path': path, 'kind': kind, 'result': resDict}
+        self.buffer.append(json.dumps(record, default=str) + '\n')
+        if (len(self.buffer) >= self.batch_size or
+            time.time() - self.last_sync >= self.sync_interval):
+            self.flush()
+
+    def take(self, path):
+        """Return (and forget) the latest step result written to path"""
+        steps = self.pending.pop(self.relpath(path), [{}])
+        return dict(steps[-1])
+
+    def flush(self):
+        if self.buffer:
+            os.write(self.fd, ''.join(self.buffer))
+            os.fsync(self.fd)
+            self.buffer = []
+        self.last_sync = time.time()
+
+    def close(self):
+        if self.fd is None:
+            return
+        for path in sorted(self.pending):
+            for resDict in self.pending[path]:
+                self.write(path, 'step', resDict)
+        self.pending = {}
+        self.flush()
+        os.close(self.fd)
+        self.fd = None
+
+def read(filename):
+    """Iterate the records of a journal file"""
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # The last record may be truncated if the run was killed
+                logger.warning("Skipping corrupt journal record in %s"%(filename))
+
+def export(result_dir):
+    """
+    Write the result.yaml files of the result tree in result_dir from
+    the journal in result_dir. Returns the number of files written.
+    """
+    filename = os.path.join(result_dir, JOURNAL_FILE)
+    if not os.path.exists(filename):
+        raise AssertionError("No journal found in %s"%(result_dir))
+
+    files = {}
+    order = []
+    for record in read(filename):
+        path = record['path']
+        if not path in files:
+            order.append(path)
+            files[path] = []
+        if record['kind'] == 'step':
+            files[path].append(record['result'])
+        else:
+            files[path] = [record['result']]
+
+    for path in order:
+        res_dir = os.path.join(result_dir, path)
+        if not os.path.isdir(res_dir):
+            os.makedirs(res_dir)
+        with open(os.path.join(res_dir, 'result.yaml'), 'w') as f:
+            yamlio.dump_all(files[path], f, explicit_start=True)
+
+    return len(order)
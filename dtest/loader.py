@@ -25,7 +25,9 @@
 #
 # Suite arguments:
 #
-#   params:   An associative array defining parameters given to the testcase
+#   params:   An associative array defining parameters given to the testcase. Given
+#             to a suite the params replace the values anchored by the same names
+#             (&name value) in the suite file - and so the aliases (*name) of them
 #
 #   count:    A number specifying the number of times to 'run' the testcase
 #
@@ -58,17 +60,60 @@
 #   expect:   By default a test is supposed to pass. By setting expect to 'fail'
 #             a failing test won't count as an error. (But it will if it passes)
 #
+#   timeout:  Maximum number of seconds a test step may run. A step still running
+#             when the timeout expires is interrupted and recorded as ERROR, and its
+#             tearDown is run. When set on a suite it applies to each of its steps.
+#             The default is given by the --timeout option (unbounded if not given).
+#
+#   cacheable:
+#             When true the result of the step is cached (see dtest.cache). The step
+#             is not run again while its test class, params and inputs are unchanged -
+#             its outputs are restored from the cache instead.
+#
+#   inputs:   List of files/dirs a cacheable step depends on (relative to the test home)
+#
+#   outputs:  List of files/dirs produced by a cacheable step. Default is its tmp dir
+#
+#   shared:   Marks a setup step as shared by the suites of the run (see dtest.shared).
+#             The step is only run again when the device state it set up may have
+#             changed. Valid values are 'run' and 'until-teardown'
+#
+#   invalidates:
+#             The step changes the device state - invalidating the shared setups.
+#             Either true (all of them) or a list of the names of the setups
+#
+#   matrix:   Runs the test once for every combination of lists of param values,
+#             optionally with exclude and include rules (see dtest.matrix). Each
+#             combination gets a dir of its own, named from its values
+#
+#   vectors:  A CSV or JSON lines file (relative to the test home) of params. The
+#             test case is run once for every row, updating its params with those
+#             of the row. The results of the rows are stored in one file in the
+#             result dir of the step (see dtest.vectors)
+#
+#   parallel: A number specifying how many of the sub-suites may run concurrently.
+#             The sub-suites are run in a pool of worker processes, each getting its
+#             own result and tmp directory. Setup and teardown steps are never run
+#             concurrently - they keep their order relative to the other sub-suites.
+#
 
 import unittest
 import logging
 import sys
 import os
 import yaml
+import yamlio
 import re
 import types
 from testsetup import testsetup
 import dtest
 import dtestsuite
+import speccache
+import nameindex
+import plan
+import matrix
+import vectors
+import shared
 import copy
 import itertools
 
@@ -76,7 +121,7 @@ logger = logging.getLogger("dtest")
 
 class DTestLoader(unittest.TestLoader):
 
-    def __init__(self, path=None, overlays=[]):
+    def __init__(self, path=None, overlays=[], specs=None, names=None, home=None):
         if isinstance(path, list):
             self.path = path
         elif isinstance(path, basestring):
@@ -90,8 +135,18 @@ class DTestLoader(unittest.TestLoader):
             self.overlays = []
         self.logger = dtest.logger
         self.logger.debug("Overlays are: %s"%(self.overlays))
+        # The test home - files named in testargs are relative to it
+        self.home = os.path.abspath(home or os.getcwd())
 
         self.testsetup = testsetup()
+        # Parsed suite specifications - kept for this load only by default
+        if specs is None:
+            specs = speccache.SpecCache()
+        self.specs = specs
+        # Resolved test names - kept for this load only by default
+        if names is None:
+            names = nameindex.NameIndex()
+        self.names = names
         self.suiteClass = dtestsuite.DtestTestSuite
         super(DTestLoader, self).__init__()
 
@@ -118,57 +173,39 @@ class DTestLoader(unittest.TestLoader):
             if count < 2:
                 raise TypeError('ERROR: count parameter is less than 2 - mistake?')
 
-    def updateSuiteParams(self,yamlstring,suiteparams):
-        def findNextWhitespace(s,begin):
-            count = 0
-            for n in s[begin:]:
-                if(n in string.whitespace):
-                    return begin+count
-                else:
-                    count+=1
+        if 'timeout' in testcaseargs:
+            timeout=testcaseargs['timeout']
+            if not isinstance( timeout, (int, long, float) ):
+                raise TypeError('timeout parameter is not a number as expected')
+            if timeout <= 0:
+                raise TypeError('ERROR: timeout parameter is not positive')
 
-        def findNextToken(s,begin):
-            count = 0
-            for n in s[begin:]:
-                if(n in string.whitespace):
-                    count += 1
-                else:
-                    return begin+count
+        if 'shared' in testcaseargs and not testcaseargs['shared'] in shared.SCOPES:
+            raise TypeError('shared parameter must be one of %s'%(', '.join(shared.SCOPES)))
 
-        def findNextChar(s,begin,token):
-            count = 0
-            for n in s[begin:]:
-                if n == token:
-                     return begin+count+1
-                else:
-                    count += 1
-
-        import string
-        i=0
-        newstring=""
-        while(not yamlstring.find("&",i) == -1):
-            anchor = yamlstring.find("&",i)
-            #value starts after next whitespace(s)
-            nextw = findNextWhitespace(yamlstring,anchor)
-            valb = findNextToken(yamlstring,nextw)
-            key = yamlstring[anchor+1:nextw]
-            #add up until after key
-            newstring += yamlstring[i:valb]
-            if yamlstring[valb] == '"' or yamlstring[valb] == "'":
-                #value ends at next " or '
-                vale = findNextChar(yamlstring, valb+1, yamlstring[valb])
-            else:
-                #value ends before next whitespace
-                vale = findNextWhitespace(yamlstring,valb)
-            if(key in suiteparams):
-                val = suiteparams[key]
-                del suiteparams[key]
-            else:
-                val = yamlstring[valb:vale]
-            newstring += str(val)
-            i = vale
-        newstring+=yamlstring[i:]
-        return newstring
+        if 'invalidates' in testcaseargs:
+            if not isinstance(testcaseargs['invalidates'], (bool, list)):
+                raise TypeError('invalidates parameter is not a boolean or a list as expected')
+
+        for arg in ('inputs', 'outputs'):
+            if arg in testcaseargs and not isinstance(testcaseargs[arg], list):
+                raise TypeError('%s parameter is not a list as expected'%(arg))
+
+        if 'matrix' in testcaseargs:
+            matrix.validate(testcaseargs['matrix'])
+
+        if 'vectors' in testcaseargs:
+            if 'matrix' in testcaseargs:
+                raise TypeError('only specify one of matrix and vectors')
+            if not isinstance(testcaseargs['vectors'], basestring):
+                raise TypeError('vectors parameter is not a file name as expected')
+
+        if 'parallel' in testcaseargs:
+            parallel=testcaseargs['parallel']
+            if not isinstance( parallel, (int, long ) ):
+                raise TypeError('parallel parameter is not int as expected')
+            if parallel < 1:
+                raise TypeError('ERROR: parallel parameter is less than 1')
 
     def loadTestsFromTestCase(self, testCaseClass, params={}, testargs={}):
         """Return a suite of all tests cases contained in testCaseClass"""
@@ -183,8 +220,9 @@ class DTestLoader(unittest.TestLoader):
              testname=testargs['id']
         else:
              testname=".".join([testCaseClass.__module__,testCaseClass.__name__])
+        # The test cases are created when they are run (see plan)
         loaded_suite = self.suiteClass([
-                testCaseClass(name, **params) for name in testCaseNames],
+                plan.TestPlan(testCaseClass, name, params) for name in testCaseNames],
                    testname)
         return loaded_suite
 
@@ -236,6 +274,9 @@ class DTestLoader(unittest.TestLoader):
             if 'exit-on-error' in testargs:
                 subtestargs['exit-on-error'] = testargs['exit-on-error']
 
+            if 'timeout' in testargs:
+                subtestargs['timeout'] = testargs['timeout']
+
             # Running a 'setup' test implicitely means exit on error
             # for children
             if 'setup' in testargs:
@@ -265,8 +306,17 @@ class DTestLoader(unittest.TestLoader):
                 # Validate test args on load
                 self.validateTestArgs(subtestargs)
 
-                test = self.loadTestsFromName(test_name, params=params,testargs=subtestargs)
-                test.testargs = subtestargs
+                if 'matrix' in subtestargs:
+                    test = self.loadMatrix(test_name, params, subtestargs,
+                                           bool(attr.get('expected_failure')))
+                elif 'vectors' in subtestargs:
+                    test = self.loadTestsFromName(test_name, params=params,testargs=subtestargs)
+                    if attr.get('expected_failure'):
+                        self.markExpectedFailure(test)
+                    test = self.loadVectors(test, subtestargs)
+                else:
+                    test = self.loadTestsFromName(test_name, params=params,testargs=subtestargs)
+                    test.testargs = subtestargs
             except:
                 logging.error('failed to load test: %s'%(test_name))
                 raise
@@ -275,20 +325,62 @@ class DTestLoader(unittest.TestLoader):
                 raise Exception()
             def boolean_attr(attr_name):
                 return attr and attr_name in attr and bool(attr[attr_name])
-            if boolean_attr('expected_failure'):
-                for test in test._tests:
-                    assert not hasattr(test, '_testMethod')
-                    testMethodName = getattr(test, '_testMethodName')
-                    setattr(test, '_testMethod', getattr(test, testMethodName))
-                    setattr(test, testMethodName, unittest.expectedFailure(
-                            test._testMethod))
-
-            # We accept empty sub-test-suites
-            if not len(test._tests) is 0:
+            if boolean_attr('expected_failure') and not getattr(test, 'generated', False):
+                self.markExpectedFailure(test)
+
+            # We accept empty sub-test-suites - generated suites are filled when run
+            if not len(test._tests) is 0 or getattr(test, 'generated', False):
                 testlist.append(test)
 
         return testlist
 
+    def markExpectedFailure(self, test):
+        """Mark the test cases of the suite test as expected to fail"""
+        for case in test._tests:
+            if isinstance(case, plan.TestPlan):
+                case.expectedFailure = True
+                continue
+            assert not hasattr(case, '_testMethod')
+            testMethodName = getattr(case, '_testMethodName')
+            setattr(case, '_testMethod', getattr(case, testMethodName))
+            setattr(case, testMethodName, unittest.expectedFailure(
+                    case._testMethod))
+
+    def loadVectors(self, test, testargs):
+        """Return a suite running the test cases of the suite test for each vector"""
+        for case in test._tests:
+            if not isinstance(case, plan.TestPlan) or isinstance(case, plan.FactoryPlan):
+                raise TypeError('vectors can only be given to test cases: %s'%(test.dirname))
+        filename = os.path.join(self.home, testargs['vectors'])
+        if not os.path.isfile(filename):
+            raise TypeError('vectors file not found: %s'%(filename))
+        suite = vectors.VectorSuite(test._tests, filename, test.dirname)
+        suite.testargs = testargs
+        suite.__doc__ = '%s for each row of %s'%(test.dirname, testargs['vectors'])
+        suite.loadname = test.loadname
+        suite.loadparams = {'params': test.loadparams, 'vectors': testargs['vectors']}
+        return suite
+
+    def loadMatrix(self, name, params, testargs, expected_failure=False):
+        """Return a suite running the test name for each point of its matrix testarg"""
+        def load(point_params, point_testargs):
+            test = self.loadTestsFromName(name, params=point_params, testargs=point_testargs)
+            test.testargs = point_testargs
+            if expected_failure:
+                self.markExpectedFailure(test)
+            return test
+
+        if 'id' in testargs:
+            dirname = testargs['id']
+        else:
+            dirname = name
+        suite = matrix.MatrixSuite(load, name, params, testargs, dirname)
+        suite.loadname = name
+        suite.loadparams = {'params': params, 'matrix': testargs['matrix']}
+        # Loads the first point - so a broken test fails the load, not the run
+        suite.countTestCases()
+        return suite
+
     def loadTestSuiteFromSpecification(self, name, path, testargs={}, suiteparams={}):
         """Return a suite from specification file"""
 
@@ -297,31 +389,27 @@ class DTestLoader(unittest.TestLoader):
         else:
             dir_name = name
 
-        name = name.split('.')
-        parts = [path] + name
-        filename = os.path.join(*parts) + '.yaml'
-        if not os.path.exists(filename):
-            parts.append('all')
-            filename = os.path.join(*parts) + '.yaml'
-            if not os.path.exists(filename):
-                return None
+        filename = self.names.specFile(path, name)
+        if filename is None:
+            return None
         self.logger.debug(
             "loading test suite YAML specification: %s"%(filename))
 
         try:
-            with open(filename, 'r') as f:
-                #parameters sent into this suite
-                #override the loaded suite yaml
-                if(suiteparams):
-                    assert isinstance(suiteparams,dict),"suite params must be a dict"
-                    yamlstring = f.read()
-                    updatedyaml = self.updateSuiteParams(yamlstring,suiteparams)
-                    #check if a param to the suite was not used, warn
-                    for k in suiteparams:
-                        print "WARNING: specified suite param not used: ",k
-                    spec = yaml.load(updatedyaml)
-                else:
-                    spec = yaml.load(f)
+            #parameters sent into this suite
+            #override the loaded suite yaml
+            if(suiteparams):
+                assert isinstance(suiteparams,dict),"suite params must be a dict"
+                # The params replace the values anchored (&name value) by their names
+                template = self.specs.template(filename, yamlio.Template)
+                spec, used = template.construct(suiteparams)
+                for k in used:
+                    del suiteparams[k]
+                #check if a param to the suite was not used, warn
+                for k in suiteparams:
+                    print "WARNING: specified suite param not used: ",k
+            else:
+                spec = self.specs.spec(filename, yamlio.load)
         except yaml.composer.ComposerError,e:
             print "ERROR: "+str(e)
             print "Did you forget to set default suite parameters?"
@@ -414,16 +502,10 @@ class DTestLoader(unittest.TestLoader):
 
         all_parts = parts = name.split('.')
         if module is None:
-            parts_copy = parts[:]
-            while parts_copy:
-                try:
-                    self.logger.debug("trying to import: "+str('.'.join(parts_copy)))
-                    module = __import__('.'.join(parts_copy), level=0)
-                    break
-                except ImportError:
-                    del parts_copy[-1]
-                    if not parts_copy:
-                        return None
+            prefix = self.names.importPrefix(name)
+            if prefix is None:
+                return None
+            module = sys.modules[prefix.split('.')[0]]
             parts = parts[1:]
         obj = module
         try:
@@ -437,20 +519,13 @@ class DTestLoader(unittest.TestLoader):
             if use_load_test and load_test is not None:
                 sname = '.'.join(parts[i:])
                 pname = '.'.join(all_parts[:i+1])
-                test = load_test(pname, sname, params, testargs=testargs)
-                if test is None:
-                    raise TypeError(
-                        "cannot load test from load_test factory: %s"%(sname))
-                if test:
-                    if 'id' in testargs:
-                        testname = testargs['id']
-                    else:
-                        testname = name
-                    test.testargs = testargs
-                    # Store the parameters which are explicit given as input parameters
-                    # This enable the parameters to be used later
-                    test.inputparams = params
-                    return self.suiteClass([test], testname)
+                if 'id' in testargs:
+                    testname = testargs['id']
+                else:
+                    testname = name
+                # The factory is called when the step runs (see plan)
+                return self.suiteClass([plan.FactoryPlan(load_test, pname, sname,
+                                                         params, testargs)], testname)
             return None
         except ImportError, e:
             if e.args[0] != 'No module named %s'%(path[0]):
@@ -475,7 +550,7 @@ class DTestLoader(unittest.TestLoader):
                 testname = testargs['id']
             else:
                 testname = name
-            return self.suiteClass([parent(obj.__name__, **params)], testname)
+            return self.suiteClass([plan.TestPlan(parent, obj.__name__, params)], testname)
         elif hasattr(obj, '__call__'):
             test = obj(**args)
             if isinstance(test, unittest.TestSuite):
@@ -505,6 +580,9 @@ class DTestLoader(unittest.TestLoader):
                     tests = self._loadTestsFromName(path, overlayed_name, params=params, testargs=testargs)
                     if tests is not None:
                         self.logger.debug('loaded tests: %s'%(overlayed_name))
+                        # Identifies the test in the duration history
+                        tests.loadname = name
+                        tests.loadparams = params
                         #sys.path = sys_path
                         return tests
         #sys.path = sys_path
@@ -0,0 +1,231 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Parameter sweeps. The matrix testarg runs a test (step or suite) once for
+# every point of the cartesian product of lists of param values:
+#
+#   - uart.loopback:
+#       params: { mode: fast }
+#       matrix:
+#         baud: [ 9600, 115200 ]
+#         size: [ 64, 1500 ]
+#         exclude:
+#           - { baud: 9600, size: 1500 }
+#         include:
+#           - { baud: 57600, size: 64 }
+#
+# The params of a point are the params of the test updated with the values
+# of the point. Points matching all the values of an exclude rule are left
+# out, and the include points are run in addition to the product.
+#
+# Each point gets its own dir below the dir of the test, named from its
+# values (baud-9600_size-64) - so the dir of a point does not depend on the
+# other points of the matrix.
+#
+# The points are loaded one by one while the matrix runs, so a big sweep is
+# never held in memory as a whole. The testargs repeating or sharing a test
+# (POINT_ARGS) apply to each point, the others to the matrix as well.
+#
+# Code reducing or adjusting the tree before the run (rerun, device pool)
+# does so through selectPoints and preparePoints rather than loading the
+# points.
+#
+
+import re
+import hashlib
+import itertools
+import logging
+import dtestsuite
+
+logger = logging.getLogger("matrix")
+
+# The keys of a matrix that are not params
+RULES = ('exclude', 'include')
+
+# The testargs applying to each point only - not to the matrix as a whole
+POINT_ARGS = ('count', 'retry', 'parallel', 'shared', 'invalidates',
+              'cacheable', 'inputs', 'outputs')
+
+# Longer point names are shortened by a hash
+MAX_NAME = 64
+
+def axes(matrix):
+    return sorted([ key for key in matrix if not key in RULES ])
+
+def _text(value):
+    """Return value as unicode - byte strings are taken as UTF-8"""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+def _matches(point, rule):
+    for key, value in rule.items():
+        if not key in point or point[key] != value:
+            return False
+    return True
+
+def _excluded(point, exclude):
+    for rule in exclude:
+        if _matches(point, rule):
+            return True
+    return False
+
+def _extra(matrix):
+    """Generate the include points of matrix that are not in the product"""
+    names = axes(matrix)
+    exclude = matrix.get('exclude', [])
+    for point in matrix.get('include', []):
+        # Points of the product are not run twice
+        if (sorted(point) == names and not _excluded(point, exclude) and
+            all([ point[name] in matrix[name] for name in names ])):
+            continue
+        yield point
+
+def points(matrix):
+    """Generate the points (dicts of param values) of matrix"""
+    names = axes(matrix)
+    exclude = matrix.get('exclude', [])
+
+    for values in itertools.product(*[ matrix[name] for name in names ]):
+        point = dict(zip(names, values))
+        if not _excluded(point, exclude):
+            yield point
+
+    for point in _extra(matrix):
+        yield dict(point)
+
+def size(matrix):
+    """
+    Return the number of points of matrix without generating them. Only
+    the product of the axes named by the exclude rules is walked to count
+    the excluded points.
+    """
+    names = axes(matrix)
+    exclude = matrix.get('exclude', [])
+    ruled = sorted(set([ key for rule in exclude for key in rule if key in matrix ]) -
+                   set(RULES))
+    free = 1
+    for name in names:
+        if not name in ruled:
+            free *= len(matrix[name])
+    excluded = 0
+    for values in itertools.product(*[ matrix[name] for name in ruled ]):
+        if _excluded(dict(zip(ruled, values)), exclude):
+            excluded += 1
+    total = 1
+    for name in ruled:
+        total *= len(matrix[name])
+    return free * (total - excluded) + len(list(_extra(matrix)))
+
+def pointName(point):
+    """Return the dir name of point"""
+    raw = u'_'.join([ u'%s-%s'%(_text(key), _text(point[key])) for key in sorted(point) ])
+    name = str(re.sub(r'[^\w.+=-]+', '_', raw))
+    # Values differing only in non-ASCII characters get their own dir
+    hashed = name
+    if any([ ord(c) > 127 for c in raw ]):
+        hashed = raw.encode('utf-8')
+    if len(name) > MAX_NAME or hashed != name:
+        name = name[:MAX_NAME - 9] + '_' + hashlib.sha1(hashed).hexdigest()[:8]
+    return name
+
+def validate(matrix):
+    """Raise TypeError if matrix is not a valid matrix testarg"""
+    if not isinstance(matrix, dict):
+        raise TypeError('matrix parameter is not a dict as expected')
+    if not axes(matrix):
+        raise TypeError('matrix parameter has no params')
+    for name in axes(matrix):
+        if not isinstance(matrix[name], list) or not matrix[name]:
+            raise TypeError('matrix param %s is not a non-empty list as expected'%(name))
+    for rule in RULES:
+        if rule in matrix:
+            if (not isinstance(matrix[rule], list) or
+                not all([ isinstance(r, dict) for r in matrix[rule] ])):
+                raise TypeError('matrix %s is not a list of dicts as expected'%(rule))
+
+class MatrixSuite(dtestsuite.DtestTestSuite):
+    """
+    The points of a matrix. load(params, testargs) loads the test of a
+    point - called when the point is about to run.
+    """
+
+    generated = True
+
+    def __init__(self, load, name, params, testargs, dirname):
+        super(MatrixSuite, self).__init__([], dirname)
+        self.load = load
+        self.testname = name
+        self.params = params
+        self.matrix = testargs['matrix']
+        self.pointargs = dict([ (k, v) for k, v in testargs.items()
+                                if not k in ('matrix', 'id', 'name') ])
+        self.testargs = dict([ (k, v) for k, v in testargs.items()
+                               if not k in POINT_ARGS ])
+        self.cases = None
+        # The dir names of the points to run - None for all
+        self.selected = None
+        self.prepares = []
+        self.__doc__ = 'Matrix of %s'%(name)
+
+    def points(self):
+        for point in points(self.matrix):
+            if self.selected is None or pointName(point) in self.selected:
+                yield point
+
+    def selectPoints(self, names):
+        """Run only the points with a dir name in names"""
+        self.selected = set(names)
+        self.cases = None
+
+    def preparePoints(self, prepare):
+        """Call prepare(name, test) with the test of each point when loaded"""
+        self.prepares.append(prepare)
+
+    def loadPoint(self, point):
+        params = dict(self.params)
+        params.update(point)
+        testargs = dict(self.pointargs)
+        testargs['id'] = pointName(point)
+        logger.debug("loading matrix point %s of %s"%(testargs['id'], self.testname))
+        test = self.load(params, testargs)
+        for prepare in self.prepares:
+            prepare(testargs['id'], test)
+        return test
+
+    def countTestCases(self):
+        if self.cases is None:
+            if self.selected is None:
+                count = size(self.matrix)
+            else:
+                # The names of points can not be mapped back to the points
+                count = sum([ 1 for point in self.points() ])
+            # Assumed the same for every point
+            first = next(self.points(), None)
+            per_point = self.loadPoint(first).countTestCases() if first is not None else 0
+            self.cases = count * per_point
+        return self.cases
+
+    def __iter__(self):
+        for point in self.points():
+            yield self.loadPoint(point)
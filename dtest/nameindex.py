@@ -0,0 +1,202 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Index of the test names resolved by the loader.
+#
+# The loader tries every overlay and every path entry for each test name:
+# the suite files <path>/a/b/c.yaml and <path>/a/b/c/all.yaml, then the
+# imports of a.b.c, a.b and a until one works. The index remembers, for
+# every name tried,
+#
+#   specs:    the suite file of (path, name) - or that there is none
+#   imports:  the longest importable prefix of name - or that there is none
+#
+# so each is only worked out once, whatever the number of references to
+# the name. Imports do not depend on the path entry, so they are resolved
+# once for all of them.
+#
+# With a file (NAME_INDEX in the test home for the dtest command) the
+# index is kept across runs. Each entry records the mtimes of the dirs its
+# outcome depends on - creating or removing a file in a dir changes its
+# mtime - and is only used while they are unchanged. The dirs are stat'ed
+# once per run. The import entries are dropped if sys.path has changed.
+#
+# Failed imports caused by an ImportError inside an existing module are
+# only remembered for the run.
+#
+
+import os
+import sys
+import json
+import logging
+import statefile
+
+logger = logging.getLogger("nameindex")
+
+NAME_INDEX = os.path.join(".dtest", "names.json")
+
+VERSION = 1
+
+def _missing(e, name):
+    """True if the ImportError e is about name itself not existing"""
+    message = str(e)
+    if not message.startswith('No module named '):
+        return False
+    missing = message[len('No module named '):]
+    return name == missing or name.endswith('.' + missing)
+
+class NameIndex(object):
+    """The resolved test names - in memory and optionally in filename"""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # path\0name -> [suite file or None, {dir: mtime}]
+        self.specs = {}
+        # name -> [importable prefix or None, {dir: mtime}]
+        self.imports = {}
+        # Outcomes only valid for this run
+        self.transient = {}
+        # dir -> mtime (None if missing) - stat'ed once per run
+        self.mtimes = {}
+        self.hits = 0
+        self.misses = 0
+        self.changed = False
+
+    @classmethod
+    def load(cls, filename=NAME_INDEX):
+        index = cls(filename)
+        stored = statefile.load_json(filename, 'name index')
+        if stored is None or stored.get('version') != VERSION:
+            return index
+        index.specs = stored.get('specs', {})
+        if stored.get('sys_path') == sys.path:
+            index.imports = stored.get('imports', {})
+        return index
+
+    def save(self):
+        if self.filename is None or not self.changed:
+            return
+        stored = {'version': VERSION, 'sys_path': sys.path,
+                  'specs': self.specs, 'imports': self.imports}
+        try:
+            # Not merged - the index of the last run saving it wins
+            statefile.replace(self.filename, lambda f: json.dump(stored, f))
+        except (IOError, OSError, TypeError, ValueError), e:
+            logger.warning("Could not save the name index %s: %s"%(self.filename, e))
+        self.changed = False
+
+    def mtime(self, directory):
+        if not directory in self.mtimes:
+            try:
+                self.mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                self.mtimes[directory] = None
+        return self.mtimes[directory]
+
+    def _depends(self, dirs):
+        """Return the dependency record of dirs"""
+        depends = {}
+        for directory in dirs:
+            directory = os.path.abspath(directory or os.curdir)
+            # A missing dir appears by being created in the nearest existing parent
+            while self.mtime(directory) is None and os.path.dirname(directory) != directory:
+                depends[directory] = None
+                directory = os.path.dirname(directory)
+            depends[directory] = self.mtime(directory)
+        return depends
+
+    def _valid(self, entry):
+        for directory, mtime in entry[1].items():
+            if self.mtime(directory) != mtime:
+                return False
+        return True
+
+    def _lookup(self, table, key):
+        entry = self.transient.get(key) or table.get(key)
+        if entry is not None and self._valid(entry):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def specFile(self, path, name):
+        """Return the suite file of the dotted name in path - None if there is none"""
+        key = '%s\0%s'%(path, name)
+        entry = self._lookup(self.specs, key)
+        if entry is not None:
+            return entry[0]
+        base = os.path.join(*([path] + name.split('.')))
+        found = None
+        for filename in (base + '.yaml', os.path.join(base, 'all.yaml')):
+            if os.path.exists(filename):
+                found = filename
+                break
+        self.specs[key] = [found, self._depends([os.path.dirname(base), base])]
+        self.changed = True
+        return found
+
+    def importPrefix(self, name):
+        """
+        Return the longest importable prefix of the dotted name - None if
+        not even the first part can be imported. The prefix is imported.
+        """
+        entry = self._lookup(self.imports, name)
+        if entry is not None:
+            prefix = entry[0]
+            if prefix is None:
+                return None
+            try:
+                __import__(prefix, level=0)
+                return prefix
+            except ImportError:
+                # Removed since - resolve it again
+                pass
+
+        parts = name.split('.')
+        transient = False
+        prefix = None
+        while parts:
+            attempt = '.'.join(parts)
+            try:
+                logger.debug("trying to import: %s"%(attempt))
+                __import__(attempt, level=0)
+                prefix = attempt
+                break
+            except ImportError, e:
+                if not _missing(e, attempt):
+                    transient = True
+                del parts[-1]
+
+        if prefix == name:
+            dirs = []
+        elif prefix is None:
+            # A top-level module would appear in one of the sys.path dirs
+            dirs = [ d for d in sys.path if not os.path.isfile(d or os.curdir) ]
+        else:
+            # A submodule of the prefix would appear in its package dirs
+            dirs = getattr(sys.modules.get(prefix), '__path__', [])
+        entry = [prefix, self._depends(dirs)]
+        if transient:
+            self.transient[name] = entry
+        else:
+            self.imports[name] = entry
+            self.changed = True
+        return prefix
@@ -0,0 +1,142 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Test cases planned by the loader but not created yet.
+#
+# The loader puts a TestPlan - the test case class, method name and params
+# - in the suite tree instead of the test case itself. Constructors of test
+# cases may read config or stat files, so creating them all up front slows
+# down loading and keeps every test in memory for the whole run.
+#
+# The suite wrapping the test cases creates them when it is run and drops
+# them again afterwards (see DtestTestSuite.run), so they live for the run
+# of their step only - including its count/retry iterations.
+#
+# Test cases produced by a load_test factory are planned the same way
+# (FactoryPlan): the factory is called with the testargs of the step when
+# the step runs, so it sees the testargs as they are then - e.g. the
+# cfg_idx of the board leased from a device pool.
+#
+# A test case failing to be created is run as a LoadFailure, which reports
+# the exception as an ERROR of the step.
+#
+
+import sys
+import logging
+import traceback
+import unittest
+import dtestcase
+
+logger = logging.getLogger("plan")
+
+class LoadFailure(dtestcase.DtestTestCase):
+    """Stand-in for a test case whose constructor failed"""
+
+    def __init__(self, plan, exc_info):
+        self.plan = plan
+        self.exc_info = exc_info
+        super(LoadFailure, self).__init__('runTest')
+
+    def __str__(self):
+        return str(self.plan)
+
+    def fullDescription(self):
+        return 'failed to create %s'%(self.plan)
+
+    def runTest(self):
+        raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+class TestPlan(object):
+    """A test case to be created when it is run"""
+
+    def __init__(self, testCaseClass, methodName, params):
+        self.testCaseClass = testCaseClass
+        self.methodName = methodName
+        self.params = params
+        self.expectedFailure = False
+
+    def __str__(self):
+        return '.'.join((self.testCaseClass.__module__,
+                         self.testCaseClass.__name__,
+                         self.methodName))
+
+    def __repr__(self):
+        return '<%s %s>'%(self.__class__.__name__, self)
+
+    def countTestCases(self):
+        return 1
+
+    def shortDescription(self):
+        return None
+
+    def build(self):
+        return self.testCaseClass(self.methodName, **self.params)
+
+    def create(self):
+        """Create the test case - a LoadFailure if its constructor fails"""
+        try:
+            test = self.build()
+        except Exception:
+            logger.debug("failed to create %s:\n%s"%(self, traceback.format_exc()))
+            return LoadFailure(self, sys.exc_info())
+        if self.expectedFailure:
+            methodName = test._testMethodName
+            test._testMethod = getattr(test, methodName)
+            setattr(test, methodName, unittest.expectedFailure(test._testMethod))
+        return test
+
+    def __call__(self, *args, **kwargs):
+        # Run outside a DtestTestSuite
+        return self.create()(*args, **kwargs)
+
+class FactoryPlan(TestPlan):
+    """A test case to be produced by the load_test factory of a module when it is run"""
+
+    def __init__(self, load_test, pname, sname, params, testargs):
+        super(FactoryPlan, self).__init__(None, None, params)
+        self.load_test = load_test
+        self.pname = pname
+        self.sname = sname
+        # The testargs of the step - shared with the suite wrapping the plan
+        self.testargs = testargs
+
+    def __str__(self):
+        return '%s.%s'%(self.pname, self.sname)
+
+    def build(self):
+        test = self.load_test(self.pname, self.sname, self.params, testargs=self.testargs)
+        if test is None:
+            raise TypeError("cannot load test from load_test factory: %s"%(self.sname))
+        test.testargs = self.testargs
+        # The parameters explicitly given as input parameters
+        test.inputparams = self.params
+        return test
+
+def create(tests):
+    """Return tests with the planned test cases created"""
+    return [ test.create() if isinstance(test, TestPlan) else test for test in tests ]
+
+def planned(tests):
+    """True if any of tests is a TestPlan"""
+    for test in tests:
+        if isinstance(test, TestPlan):
+            return True
+    return False
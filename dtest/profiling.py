@@ -0,0 +1,151 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# A low-overhead sampling profiler separating the time spent in dtest
+# itself from the time spent in the test bodies. The run is split in
+# phases:
+#
+#   load:      loading the tests (DTestLoader)
+#   framework: dtest code running the tests (suites, results, reporting)
+#   test:      the test bodies (setUp, the test method and tearDown)
+#
+# The main thread is sampled on CPU time (SIGPROF). The wall time of each
+# phase is measured when switching phase. profile.write() produces:
+#
+#   profile.folded:         collapsed stacks of all phases (the phase is the
+#                           root frame) - input for flamegraph.pl
+#   profile-<phase>.folded: collapsed stacks of a single phase
+#   profile-summary.txt:    wall/CPU time per phase and the top functions
+#
+# Forked workers (parallel suites, device pool) are not sampled.
+#
+
+import os
+import sys
+import time
+import signal
+import logging
+
+logger = logging.getLogger("profiling")
+
+PHASES = ('load', 'framework', 'test')
+
+_profiler = None
+
+class SamplingProfiler(object):
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = dict((phase, {}) for phase in PHASES)
+        self.wall = dict((phase, 0.0) for phase in PHASES)
+        self.current = 'framework'
+        self.switched = time.time()
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)'%(code.co_name,
+                         os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        stack = ';'.join(stack)
+        samples = self.samples[self.current]
+        samples[stack] = samples.get(stack, 0) + 1
+
+    def phase(self, name):
+        now = time.time()
+        self.wall[self.current] += now - self.switched
+        self.switched = now
+        previous = self.current
+        self.current = name
+        return previous
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        # Restart system calls interrupted by the sampling
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.switched = time.time()
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.phase(self.current)
+
+    def write(self, directory):
+        with open(os.path.join(directory, 'profile.folded'), 'w') as total:
+            for phase in PHASES:
+                with open(os.path.join(directory, 'profile-%s.folded'%(phase)), 'w') as f:
+                    for stack, count in sorted(self.samples[phase].items()):
+                        f.write('%s %d\n'%(stack, count))
+                        total.write('%s;%s %d\n'%(phase, stack, count))
+
+        with open(os.path.join(directory, 'profile-summary.txt'), 'w') as f:
+            f.write(self.summary())
+
+    def summary(self, top=10):
+        lines = []
+        wall_total = sum(self.wall.values()) or 1.0
+        lines.append('%-10s %12s %7s %12s'%('phase', 'wall [s]', 'wall %', 'cpu [s]'))
+        for phase in PHASES:
+            cpu = sum(self.samples[phase].values()) * self.interval
+            lines.append('%-10s %12.3f %6.1f%% %12.3f'%(
+                phase, self.wall[phase], 100.0 * self.wall[phase] / wall_total, cpu))
+
+        for phase in PHASES:
+            # Samples per function at the top of the stack
+            own = {}
+            for stack, count in self.samples[phase].items():
+                leaf = stack.rsplit(';', 1)[-1]
+                own[leaf] = own.get(leaf, 0) + count
+            if not own:
+                continue
+            lines.append('')
+            lines.append('Top functions (%s):'%(phase))
+            for leaf, count in sorted(own.items(), key=lambda x: -x[1])[:top]:
+                lines.append('  %8.3fs  %s'%(count * self.interval, leaf))
+        return '\n'.join(lines) + '\n'
+
+def start(interval=0.005):
+    """Start profiling the run"""
+    global _profiler
+    if not hasattr(signal, 'setitimer'):
+        raise AssertionError("profiling is not supported on this platform")
+    _profiler = SamplingProfiler(interval)
+    _profiler.start()
+
+def phase(name):
+    """Switch to phase name - returns the previous phase. No-op when not profiling."""
+    if _profiler is None:
+        return None
+    return _profiler.phase(name)
+
+def stop(directory):
+    """Stop profiling and write the result files to directory"""
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.stop()
+    _profiler.write(directory)
+    logger.info("profile written to %s"%(directory))
+    sys.stdout.write(_profiler.summary())
+    _profiler = None
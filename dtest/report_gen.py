@@ -18,7 +18,7 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 #
 
-import yaml
+import yamlio
 import os
 import glob
 import datetime
@@ -69,7 +69,7 @@ class TestSetup():
             logger.info("Config file not given - using standard values")
         else:
             logger.info("Config file given - loading it")
-            self.config = yaml.load(file(config_file,'r'))
+            self.config = yamlio.load_file(config_file)
 
     def get(self,key):
         try:
@@ -0,0 +1,281 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Console reporters used by DTestResult to show the progress of a run.
+#
+#   tty:      One line per test, the running test is shown while it runs
+#   plain:    One line per test written when the test is done (CI logs)
+#   json:     One JSON object per test
+#   progress: A single status line, redrawn at a limited rate
+#   quiet:    No output
+#
+
+import os
+import sys
+import json
+import time
+
+_columns = None
+
+def terminal_columns():
+    """Return the width of the terminal. Detected once and then cached."""
+    global _columns
+    if _columns is not None:
+        return _columns
+
+    columns = 0
+    if sys.platform.lower().startswith('win'):
+        try:
+            import struct
+            from ctypes import windll, create_string_buffer
+            # stdin handle is -10
+            # stdout handle is -11
+            # stderr handle is -12
+            h = windll.kernel32.GetStdHandle(-12)
+            csbi = create_string_buffer(22)
+            res = windll.kernel32.GetConsoleScreenBufferInfo(h, csbi)
+            if res:
+                (bufx, bufy, curx, cury, wattr,
+                 left, top, right, bottom,
+                 maxx, maxy) = struct.unpack("hhhhHhhhhhh", csbi.raw)
+                columns = right - left + 1
+        except Exception:
+            pass
+    else:
+        try:
+            import fcntl
+            import termios
+            import struct
+            for fd in (sys.stdout.fileno(), sys.stdin.fileno()):
+                try:
+                    rows, columns = struct.unpack('hh', fcntl.ioctl(
+                        fd, termios.TIOCGWINSZ, '1234'))
+                    break
+                except IOError:
+                    continue
+        except Exception:
+            pass
+        if not columns:
+            try:
+                columns = int(os.environ.get('COLUMNS', 0))
+            except ValueError:
+                pass
+
+    if columns <= 20:
+        columns = 160 #running headless
+    _columns = columns
+    return _columns
+
+class Reporter(object):
+    """
+    Base class of the console reporters. The tests write to stdout
+    directly, so the lines of a reporter are written and flushed right
+    away to keep them in order with the output of the tests. Only the
+    redraws of the progress line are throttled (see ProgressReporter).
+    """
+
+    def __init__(self, show_time=True):
+        self.show_time = show_time
+        self.total = None
+        self.expected = None
+        self.started = time.time()
+
+    def write(self, text):
+        # Looked up on every write - the output of parallel workers is
+        # captured by replacing sys.stdout
+        sys.stdout.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def verdict(self, result, time_spent):
+        if self.show_time:
+            return '%s [%.3fs]'%(result, time_spent)
+        return result
+
+    def startRun(self, total=None, expected=None):
+        self.total = total
+        self.expected = expected
+        self.started = time.time()
+
+    def eta(self, done):
+        """
+        Return the estimated remaining time of the run in seconds - based on
+        the expected duration from the history or else the rate of progress
+        """
+        elapsed = time.time() - self.started
+        if self.expected and elapsed < self.expected:
+            return self.expected - elapsed
+        if done and self.total and done < self.total:
+            return elapsed * (self.total - done) / done
+        return None
+
+    def startTest(self, test, description):
+        pass
+
+    def stopTest(self, test, description, result, time_spent):
+        pass
+
+    def stopRun(self):
+        self.flush()
+
+    def isolated(self):
+        """Return the reporter to use for a suite run in a worker process"""
+        return self
+
+    def merge(self, outcome):
+        """Account for the outcome of a suite run in a worker process"""
+        pass
+
+class TTYReporter(Reporter):
+    """The interactive layout: the running test is shown until it is done"""
+
+    def startTest(self, test, description):
+        line = description
+        line_length = len(line)
+
+        # Text should end 20 char from right-handside of the terminal
+        # It makes space for the verdict
+        max_length = terminal_columns() - 20
+        line_start = 0
+
+        number_of_lines = line_length // max_length
+        for line_number in range(0,number_of_lines):
+            self.write("%s\n"%line[line_start:line_start+max_length])
+            line_start=line_start+max_length
+
+        # Python seems to not care about indexing outside the string..
+        nline = line[line_start:line_start+max_length]
+        self.write("%s  "%(nline.ljust(max_length,'.')))
+        # Flush the content of the line so fare - in order to see the current test running
+        self.flush()
+
+    def stopTest(self, test, description, result, time_spent):
+        self.write(self.verdict(result, time_spent) + '\n')
+        self.flush()
+
+class PlainReporter(Reporter):
+    """One complete line per test - no partial lines and no wrapping"""
+
+    def stopTest(self, test, description, result, time_spent):
+        self.write('%s ... %s\n'%(description, self.verdict(result, time_spent)))
+        self.flush()
+
+class JsonReporter(Reporter):
+    """One JSON object per line for each test"""
+
+    def stopTest(self, test, description, result, time_spent):
+        record = {'test': str(test), 'description': description,
+                  'result': result, 'time': time_spent}
+        self.write(json.dumps(record, default=str) + '\n')
+        self.flush()
+
+class ProgressReporter(Reporter):
+    """A single status line which is redrawn at most rate times per second"""
+
+    width = 30
+    rate = 10
+
+    def __init__(self, show_time=True, rate=None):
+        super(ProgressReporter, self).__init__(show_time)
+        if rate is not None:
+            self.rate = rate
+        self.last_redraw = 0
+        self.done = 0
+        self.counts = {}
+        self.current = ''
+
+    def startTest(self, test, description):
+        self.current = str(test)
+        self.redraw()
+
+    def stopTest(self, test, description, result, time_spent):
+        self.done += 1
+        self.counts[result] = self.counts.get(result, 0) + 1
+        self.redraw()
+
+    def isolated(self):
+        # Workers are silent - the parent redraws when merging their outcome
+        return Reporter(self.show_time)
+
+    def merge(self, outcome):
+        others = 0
+        for vector, result in (('failures', 'FAIL'), ('errors', 'ERROR'),
+                               ('skipped', 'SKIP')):
+            n = len(outcome[vector])
+            if n:
+                self.counts[result] = self.counts.get(result, 0) + n
+            others += n
+        passed = outcome['testsRun'] - others
+        if passed > 0:
+            self.counts['PASS'] = self.counts.get('PASS', 0) + passed
+        self.done += outcome['testsRun']
+        self.redraw()
+
+    def status(self):
+        counts = ' '.join([ '%s:%d'%(k, self.counts[k]) for k in sorted(self.counts) ])
+        if self.total:
+            # Retries may run more tests than expected
+            total = max(self.total, self.done)
+            filled = self.width * self.done // total
+            bar = '[%s%s] %d/%d'%('#' * filled, ' ' * (self.width - filled),
+                                  self.done, total)
+        else:
+            bar = '%d'%(self.done)
+        eta = self.eta(self.done)
+        if eta is not None:
+            bar += ' ETA %d:%02d'%(eta // 60, eta % 60)
+        return '%s %s %s'%(bar, counts, self.current)
+
+    def redraw(self, force=False):
+        now = time.time()
+        if not force and now - self.last_redraw < 1.0 / self.rate:
+            return
+        self.last_redraw = now
+        line = self.status()[:terminal_columns() - 1]
+        self.write('\r' + line.ljust(terminal_columns() - 1))
+        self.flush()
+
+    def stopRun(self):
+        self.current = ''
+        self.redraw(force=True)
+        self.write('\n')
+        self.flush()
+
+reporters = {
+    'tty': TTYReporter,
+    'plain': PlainReporter,
+    'json': JsonReporter,
+    'progress': ProgressReporter,
+    'quiet': Reporter,
+}
+
+def create(name=None, show_time=True):
+    """
+    Create a reporter by name. Without a name the tty reporter is used
+    when stdout is a terminal and the plain reporter otherwise.
+    """
+    if name is None:
+        if hasattr(sys.stdout, 'isatty') and sys.stdout.isatty():
+            name = 'tty'
+        else:
+            name = 'plain'
+    return reporters[name](show_time=show_time)
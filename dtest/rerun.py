@@ -0,0 +1,200 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Re-running the failed steps of a previous run.
+#
+# The failed steps are collected from the result tree of the previous run
+# with result_parse - or from its journal if it was run with one. The
+# suite of the previous run is loaded again and
+# reduced to the failed steps, the suites enclosing them and the setup and
+# teardown steps of those suites. The steps thus run with the same params
+# and testargs as in the previous run.
+#
+# Loaded tests are matched to result dirs by assigning the dir names the
+# same way DtestTestSuite does (name, name-1, name-2, ...). The run-<n>
+# dirs of count and retry iterations are ignored - a suite using count or
+# retry is re-run with all of its iterations.
+#
+# The points of a matrix are not loaded up front - the matrix is told which
+# of them to run and reduces them as they are loaded. The rows of vectors
+# share the dir of their step, so a failed vectors step is re-run with all
+# of its rows.
+#
+
+import os
+import re
+import glob
+import logging
+import result_parse
+import dtestsuite
+import journal
+
+logger = logging.getLogger("rerun")
+
+FAILED = ('FAIL', 'ERROR')
+
+_iteration = re.compile(r'^run-\d+$')
+
+def _strip_iterations(path):
+    return os.sep.join([ part for part in path.split(os.sep)
+                         if not _iteration.match(part) ])
+
+def _node_tree(result_dir):
+    """The result tree of the run in result_dir - which has no result.yaml itself"""
+    root = result_parse.result_node(result_dir, 'ROOT', True)
+    for path in sorted(glob.glob(os.path.join(result_dir, '*'))):
+        if os.path.isdir(path):
+            result_parse.process_dirs(path, root)
+    result_parse.sort_results(root)
+    return root
+
+def _tree_results(result_dir):
+    """The result of each path (relative to result_dir) of the result tree"""
+    results = {}
+
+    def add(node):
+        results[os.path.relpath(node.path, result_dir)] = node.result
+        for child in node.children:
+            add(child)
+
+    for node in _node_tree(result_dir).children:
+        add(node)
+    return results
+
+def _journal_results(result_dir):
+    """The result of each path (relative to result_dir) of the journal"""
+    results = {}
+    for record in journal.read(os.path.join(result_dir, journal.JOURNAL_FILE)):
+        path = record['path']
+        if (record['kind'] == 'step' and path in results and
+            results[path].get('result') in FAILED):
+            # Another test case of the step failed
+            continue
+        results[path] = record['result']
+    return results
+
+def failed_steps(result_dir):
+    """
+    Return the paths (relative to result_dir) of the failed steps of the
+    run in result_dir. Steps below a suite which finally passed, e.g.
+    failed attempts of a retry, are not included. Raises AssertionError if
+    result_dir holds no results.
+    """
+    result_dir = os.path.abspath(result_dir)
+    if os.path.exists(os.path.join(result_dir, journal.JOURNAL_FILE)):
+        results = _journal_results(result_dir)
+    else:
+        results = _tree_results(result_dir)
+    if not results:
+        raise AssertionError("No results found in %s"%(result_dir))
+
+    # A dir without results of its own, e.g. lost when the run was killed,
+    # is skipped like result_parse does
+    children = {}
+    for path in results:
+        parent = os.path.dirname(path)
+        while parent and not parent in results:
+            parent = os.path.dirname(parent)
+        children.setdefault(parent, []).append(path)
+
+    failed = set()
+
+    def collect(path):
+        if not path in children:
+            failed.add(path)
+            return
+        for child in children[path]:
+            if results[child].get('result') in FAILED:
+                collect(child)
+
+    for path in children.get('', []):
+        if results[path].get('result') in FAILED:
+            collect(path)
+    return set([ _strip_iterations(path) for path in failed ])
+
+def _is_fixture(test):
+    testargs = getattr(test, 'testargs', None) or {}
+    return testargs.get('setup') is True or testargs.get('teardown') is True
+
+def prune(suite, failed, path=''):
+    """
+    Reduce suite (in place) to the tests leading to the paths in failed
+    plus the setup and teardown steps on the way. Returns the number of
+    failed steps kept - if none, suite is left unchanged and must not be run.
+    """
+    wanted = set()
+    for step in failed:
+        parts = step.split(os.sep)
+        for i in range(1, len(parts) + 1):
+            wanted.add(os.sep.join(parts[:i]))
+    return _prune(suite, failed, wanted, path)
+
+def _prune(suite, failed, wanted, path):
+    kept = 0
+    tests = []
+    taken = set()
+    for test in suite._tests:
+        if not isinstance(test, dtestsuite.DtestTestSuite):
+            # A test case of a step - the step dir is path itself
+            tests.append(test)
+            continue
+        dirname = test.dirname
+        i = 0
+        while dirname in taken:
+            i += 1
+            dirname = test.dirname + "-" + str(i)
+        taken.add(dirname)
+
+        test_path = os.path.join(path, dirname)
+        if test_path in failed:
+            # A failed step (or a suite reported as failed as a whole)
+            tests.append(test)
+            kept += 1
+        elif test_path in wanted:
+            if test.generated:
+                n = _prunePoints(test, failed, wanted, test_path)
+            else:
+                n = _prune(test, failed, wanted, test_path)
+            if n:
+                tests.append(test)
+                kept += n
+        elif _is_fixture(test):
+            tests.append(test)
+    if kept:
+        suite._tests = tests
+    return kept
+
+def _prunePoints(suite, failed, wanted, path):
+    """Reduce the generated suite to the points leading to the paths in failed"""
+    below = [ step for step in failed if step.startswith(path + os.sep) ]
+    if not hasattr(suite, 'selectPoints'):
+        # Run as a whole
+        return len(below)
+    names = set([ step[len(path) + 1:].split(os.sep)[0] for step in below ])
+
+    def prepare(name, test):
+        point_path = os.path.join(path, name)
+        if not point_path in failed and isinstance(test, dtestsuite.DtestTestSuite):
+            _prune(test, failed, wanted, point_path)
+
+    suite.selectPoints(names)
+    suite.preparePoints(prepare)
+    return len(below)
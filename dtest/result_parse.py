@@ -23,7 +23,7 @@
 # by a dtest run
 #
 
-import yaml
+import yamlio
 import os
 import logging
 import glob
@@ -73,7 +73,7 @@ class count_or_retry(result_node):
 def process_dirs(path, parrent_node):
    result_file = os.path.join(path,"result.yaml")
    if os.path.exists(result_file):
-       result = yaml.load(file(result_file,'r'))
+       result = yamlio.load_file(result_file)
        if 'name' in result:
            name=result['name']
        else:
@@ -129,8 +129,10 @@ def generate_node_tree(rootpath, uniq_names=False, keep_multiple_runs=True):
       a result_node tree
     """
 
-    ch = logging.StreamHandler()
-    logger.addHandler(ch)
+    # Called again for each tree parsed by a process (see benchmark)
+    if not logger.handlers:
+        ch = logging.StreamHandler()
+        logger.addHandler(ch)
     logger.setLevel(logging.INFO)
 
     topnode = result_node(rootpath, 'ROOT', True)
@@ -0,0 +1,137 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Support for resuming an interrupted run inside its own result dir.
+#
+# The tests of a run are stored in RUN_FILE in the result dir, so the same
+# suite can be loaded again. When resuming, the suite is run again from the
+# start but DtestTestSuite skips every step, suite and count/retry
+# iteration whose result dir already holds a final result. Their results
+# are replayed into the result object instead, so the summary covers the
+# whole run.
+#
+# The directories of the run are claimed in the same order as in the
+# original run, so each test gets back the directory it had before.
+#
+
+import os
+import logging
+import yamlio
+import journal
+
+logger = logging.getLogger("resume")
+
+RUN_FILE = "dtest-run.yaml"
+
+def write_run_file(result_dir, tests, **options):
+    """Store the tests given to the run (and options selecting tests) in result_dir"""
+    run = dict(options)
+    run['tests'] = list(tests)
+    with open(os.path.join(result_dir, RUN_FILE), 'w') as f:
+        yamlio.dump(run, f, default_flow_style=False)
+
+def read_run_file(result_dir):
+    """Return the dict stored by write_run_file in result_dir"""
+    filename = os.path.join(result_dir, RUN_FILE)
+    if not os.path.exists(filename):
+        raise AssertionError("%s has no %s - tests must be given"%(result_dir, RUN_FILE))
+    with open(filename, 'r') as f:
+        return yamlio.load(f)
+
+def _load_result_file(filename):
+    """Return the last document of a result.yaml file - None if unreadable"""
+    try:
+        with open(filename, 'r') as f:
+            docs = [ doc for doc in yamlio.load_all(f) if doc ]
+    except (IOError, yamlio.YAMLError), e:
+        # Most likely truncated when the run was killed
+        logger.warning("Ignoring %s: %s"%(filename, e))
+        return None
+    if not docs or not 'result' in docs[-1]:
+        return None
+    return docs[-1]
+
+class ResumeState(object):
+    """
+    The final results found in the result dir of an interrupted run.
+    Results are keyed on their directory relative to the result dir.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.results = {}
+        # The results found below each directory
+        self.below = {}
+        self.claimed = set()
+
+    @classmethod
+    def load(cls, root):
+        state = cls(root)
+        if os.path.exists(os.path.join(state.root, journal.JOURNAL_FILE)):
+            state.readJournal()
+        else:
+            state.readTree()
+        for key in state.results:
+            parent = os.path.dirname(key)
+            while parent:
+                state.below.setdefault(parent, []).append(key)
+                parent = os.path.dirname(parent)
+        logger.info("Found %d final results in %s"%(len(state.results), root))
+        return state
+
+    def readTree(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if not 'result.yaml' in filenames or dirpath == self.root:
+                continue
+            res = _load_result_file(os.path.join(dirpath, 'result.yaml'))
+            if res is not None:
+                self.results[os.path.relpath(dirpath, self.root)] = res
+
+    def readJournal(self):
+        for record in journal.read(os.path.join(self.root, journal.JOURNAL_FILE)):
+            if 'result' in record['result']:
+                self.results[record['path']] = record['result']
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def isClaimed(self, path):
+        """True if path has been claimed by a test of the resumed run"""
+        return self.relpath(path) in self.claimed
+
+    def claim(self, path):
+        self.claimed.add(self.relpath(path))
+
+    def isComplete(self, path):
+        """True if the test of result dir path has its final result"""
+        return self.relpath(path) in self.results
+
+    def get(self, path):
+        return self.results[self.relpath(path)]
+
+    def steps(self, path):
+        """Iterate (relpath, result) of the test steps at or below path"""
+        top = self.relpath(path)
+        for key in [top] + sorted(self.below.get(top, [])):
+            # A step is a result without results below it. Its type is
+            # 'teststep' or the type of the suite wrapping it, e.g. 'setup'
+            if not key in self.below:
+                yield key, self.results[key]
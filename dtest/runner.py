@@ -23,9 +23,16 @@ import logging
 import sys
 import os
 import time
-import yaml
+import dtest.yamlio
 import dctrl
 import ast
+import dtest.reporter
+import dtest.usage
+import dtest.profiling
+import dtest.watchdog
+import dtest.shared
+import dtest.dirs
+import dtest.dtestcase
 
 # override TestCase '__str__' method
 def dtest_testcase_str(self):
@@ -46,13 +53,45 @@ class DTestResult(unittest.result.TestResult):
     separator1 = '=' * 70
     separator2 = '-' * 70
 
+    # When set, results are appended to this journal.Journal instead of
+    # being written to result.yaml files
+    journal = None
+
+    # Number of tests in the run - used by the reporter to show progress
+    total = None
+
+    # The result dir of the steps which are not DtestTestCases - set by
+    # the suite running them
+    result_dir = None
+
+    # Default timeout in seconds of the test steps (see watchdog)
+    timeout = None
+
+    # resume.ResumeState of the interrupted run being resumed
+    resume = None
+
+    # history.DurationHistory of previous runs, and the expected duration
+    # of the run according to it (None if unknown)
+    history = None
+    expected = None
+
+    # cache.ResultCache of cacheable steps
+    cache = None
+
+    # shared.SharedSetups of the run
+    shared = None
+
+    # flakes.FlakeDB of previous runs
+    flakes = None
+
     # result output:
     #   * success: True/False
     #   * result: simple string, no newlines
     #   * log: multi-line string
     #   * errors: multi-line string
 
-    def __init__(self, descriptions=True, show_time=True, store_result=True):
+    def __init__(self, descriptions=True, show_time=True, store_result=True,
+                 reporter=None):
         super(DTestResult, self).__init__()
 
         self.success = None
@@ -60,28 +99,9 @@ class DTestResult(unittest.result.TestResult):
         self.descriptions = descriptions
         self.show_time = show_time
         self.store_result = store_result
-        if sys.platform.lower().startswith('linux'):
-            rows, columns = os.popen('stty size', 'r').read().split()
-        else:
-            import struct
-            from ctypes import windll, create_string_buffer
-            # stdin handle is -10
-            # stdout handle is -11
-            # stderr handle is -12
-            h = windll.kernel32.GetStdHandle(-12)
-            csbi = create_string_buffer(22)
-            res = windll.kernel32.GetConsoleScreenBufferInfo(h, csbi)
-            if res:
-                (bufx, bufy, curx, cury, wattr,
-                 left, top, right, bottom,
-                 maxx, maxy) = struct.unpack("hhhhHhhhhhh", csbi.raw)
-                columns = right - left + 1
-                rows = bottom - top + 1
-            else:
-                columns = 160 #running headless
-        self.columns = int(columns)
-	if self.columns == 0:
-	   self.columns = 160
+        if reporter is None:
+            reporter = dtest.reporter.create(show_time=show_time)
+        self.reporter = reporter
 
     def wasSuccessful(self):
         "Tells whether or not this result was a success"
@@ -100,45 +120,40 @@ class DTestResult(unittest.result.TestResult):
         self.log = ""
         self.err = ""
         self.start_time = time.time()
-        line = self.getDescription(test)
-
-        line_length = int(line.__len__())
-
-        # Text should end 20 char from right-handside of the terminal
-        # It makes space for the verdict
-        max_length = self.columns -20
-        line_start=0
-
-        allow_multiline = True
-
-        if allow_multiline:
-            number_of_lines = line_length // max_length
-            for line_number in range(0,number_of_lines):
-                print "%s"%line[line_start:line_start+max_length]
-                line_start=line_start+max_length
-
-        # Python seems to not care about indexing outside the string..
-        nline = line[line_start:line_start+max_length]
-        print "%s "%(nline.ljust(max_length,'.')),
-        # Flush the content of the line so fare - in order to see the current test running
-        sys.stdout.flush()
-
-    def addResult(self, test, result):
-        if self.show_time and hasattr(self, 'start_time'):
-            time_spent = time.time() - self.start_time
-            print '%s [%.3fs]'%(result, time_spent)
-        else:
-            print result
-
-        if self.store_result:
+        self.start_usage = dtest.usage.snapshot()
+        self.reporter.startTest(test, self.getDescription(test))
+        # Everything until the verdict is the test body
+        dtest.profiling.phase('test')
+
+    def addResult(self, test, result, details=None):
+        dtest.profiling.phase('framework')
+        time_spent = time.time() - self.start_time
+        usage = dtest.usage.delta(self.start_usage)
+        self.reporter.stopTest(test, self.getDescription(test), result, time_spent)
+
+        vectorLog = getattr(test, 'vectorLog', None)
+        if self.store_result and vectorLog is not None:
+            # A row of a vectors file - one line in the file of its step
+            error = None
+            if result in ('FAIL', 'ERROR'):
+                failed = self.failures if result == 'FAIL' else self.errors
+                if failed and failed[-1][0] is test:
+                    error = failed[-1][1].strip().splitlines()[-1]
+            vectorLog.append(self.stepDir(test), test.vectorRow, test.vectorParams,
+                             result, time_spent, error)
+        elif self.store_result:
             resDict = {}
             resDict['result'] = result
             resDict['time'] = time_spent
+            if usage is not None:
+                resDict['usage'] = usage
             # Store start time for report generation
             resDict['start_time'] = self.start_time
             resDict['type'] = 'teststep'
             # Store the description for report generation
             resDict['description'] = '%s'%test.fullDescription()
+            if details:
+                resDict.update(details)
 
             if hasattr(test,'params'):
                 # Test case has parameters - store them
@@ -176,9 +191,13 @@ class DTestResult(unittest.result.TestResult):
                except Exception, e:
                  resDict['output'] = test.output
 
-            path = self.result_dir
-            with open(os.path.join(path, 'result.yaml'), 'a') as f:
-                yaml.dump(resDict,f, explicit_start=True)
+            path = self.stepDir(test)
+            if self.journal is not None:
+                self.journal.append(path, 'step', resDict)
+            else:
+                dtest.dirs.materialize(path)
+                with open(os.path.join(path, 'result.yaml'), 'a') as f:
+                    dtest.yamlio.dump(resDict,f, explicit_start=True)
             if hasattr(self, 'log') and self.log:
                 with open(os.path.join(path, 'log'), 'w') as f:
                     f.write(self.err)
@@ -186,14 +205,29 @@ class DTestResult(unittest.result.TestResult):
                 with open(os.path.join(path, 'err'), 'w') as f:
                     f.write(self.err)
 
+    def stepDir(self, test):
+        """The result dir of the step test - given to it by its suite"""
+        if isinstance(test, dtest.dtestcase.DtestTestCase) and test._resultDir:
+            return test._resultDir
+        return self.result_dir
+
     def addSuccess(self, test):
         super(DTestResult, self).addSuccess(test)
         self.addResult(test, 'PASS')
 
+    def addCached(self, test, key):
+        """The step was not run - its outputs were restored from the result cache"""
+        super(DTestResult, self).addSuccess(test)
+        self.addResult(test, 'PASS', {'cached': key})
+
     def addError(self, test, err):
         super(DTestResult, self).addError(test, err)
         self._mirrorOutput = False
-        self.addResult(test, 'ERROR')
+        details = None
+        if issubclass(err[0], dtest.watchdog.StepTimeout):
+            # Keep the stack the step was stuck in
+            details = {'timeout': self.errors[-1][1]}
+        self.addResult(test, 'ERROR', details)
 
     def addFailure(self, test, err):
         super(DTestResult, self).addFailure(test, err)
@@ -219,6 +253,18 @@ class DTestResult(unittest.result.TestResult):
         #self.addResult(test, 'FAIL (unexpected success)')
         self.addResult(test, 'FAIL')
 
+    def stopTest(self, test):
+        dtest.profiling.phase('framework')
+        super(DTestResult, self).stopTest(test)
+
+    def startTestRun(self):
+        super(DTestResult, self).startTestRun()
+        self.reporter.startRun(self.total, self.expected)
+
+    def stopTestRun(self):
+        super(DTestResult, self).stopTestRun()
+        self.reporter.stopRun()
+
     def printErrors(self):
         self.printErrorList('ERROR', self.errors)
         self.printErrorList('FAIL', self.failures)
@@ -237,7 +283,9 @@ class DTestRunner(object):
 
     def __init__(self, descriptions=True, verbosity=2, failfast=False,
                  show_time=True, show_errors=True, show_summary=True,
-                 resultclass=None):
+                 resultclass=None, devicepool=None, journal=None,
+                 reporter=None, timeout=None, resume=None, history=None,
+                 cache=None, flakes=None):
         self.descriptions = descriptions
         self.verbosity = verbosity
         self.failfast = failfast
@@ -246,15 +294,39 @@ class DTestRunner(object):
         self.show_summary = show_summary
         if resultclass is not None:
             self.resultclass = resultclass
+        self.devicepool = devicepool
+        self.journal = journal
+        self.reporter = reporter
+        self.timeout = timeout
+        self.resume = resume
+        self.history = history
+        self.cache = cache
+        self.flakes = flakes
 
     def run(self, test, resultDir, tmpDir):
         """Run the given test case or test suite"""
 
+        kwargs = {}
+        if self.reporter is not None:
+            kwargs['reporter'] = dtest.reporter.create(self.reporter, self.show_time)
         result = self.resultclass(
-                     descriptions=self.descriptions, show_time=self.show_time)
+                     descriptions=self.descriptions, show_time=self.show_time,
+                     **kwargs)
+        result.total = test.countTestCases()
 
         unittest.signals.registerResult(result)
         result.failfast = self.failfast
+        result.journal = self.journal
+        result.timeout = self.timeout
+        result.resume = self.resume
+        result.history = self.history
+        result.cache = self.cache
+        result.shared = dtest.shared.SharedSetups()
+        result.durations = {}
+        result.flakes = self.flakes
+        result.outcomes = {}
+        if self.history is not None:
+            result.expected = self.history.estimate(test)
 
         start_time = time.time()
         def result_func(name):
@@ -264,9 +336,23 @@ class DTestRunner(object):
         result_func('startTestRun')
         try:
             # redirect logging, stdout, and stderr output to buffer
-            test(result=result, resultDir=resultDir, tmpDir=tmpDir)
+            if self.devicepool is not None:
+                # Each top-level suite is run on a device from the pool
+                import devicepool
+                scheduler = devicepool.DeviceScheduler(self.devicepool)
+                scheduler.run(test, result, resultDir, tmpDir)
+            else:
+                test(result=result, resultDir=resultDir, tmpDir=tmpDir)
         finally:
             result_func('stopTestRun')
+            if self.journal is not None:
+                self.journal.close()
+            if self.history is not None:
+                self.history.update(result.durations)
+                self.history.save()
+            if self.flakes is not None:
+                self.flakes.update(result.outcomes)
+                self.flakes.save()
         time_spent = time.time() - start_time
         print
 
@@ -0,0 +1,241 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Splitting a run into N shards, e.g. for running on N CI hosts, and
+# merging the result trees of the shards into one.
+#
+# The suites at a given depth below the top-level suites are the units
+# distributed over the shards. Depth 0 distributes the top-level suites
+# themselves, depth 1 (the default) their sub-suites and so on. Setup and
+# teardown steps are not distributed - every shard runs the setup and
+# teardown steps of the suites enclosing its units.
+#
+# Units are assigned longest first to the least loaded shard. The weight
+# of a unit is its expected duration according to the duration history if
+# known for all units, and otherwise its number of test cases. The
+# assignment only depends on the loaded tests (and the history), so all
+# shards compute the same assignment. With a history all shards must use
+# the same history file.
+#
+# The dir names of the suites are fixed before the tree is reduced, so a
+# suite gets the same result dir as in an unsharded run and the merged
+# tree looks like the result of an unsharded run.
+#
+
+import os
+import re
+import shutil
+import logging
+import yamlio
+import dtestsuite
+import journal
+import resume
+
+logger = logging.getLogger("shard")
+
+def parse(spec):
+    """Parse a shard spec i/N - returns (i, N) with 1 <= i <= N"""
+    m = re.match(r'^(\d+)/(\d+)$', spec)
+    if not m:
+        raise ValueError("shard must be given as i/N, not %s"%(spec))
+    index, count = int(m.group(1)), int(m.group(2))
+    if not 1 <= index <= count:
+        raise ValueError("shard %s out of range"%(spec))
+    return index, count
+
+def _is_fixture(test):
+    testargs = getattr(test, 'testargs', None) or {}
+    return testargs.get('setup') is True or testargs.get('teardown') is True
+
+def _suites(test):
+    # A generated suite (matrix, vectors) is a unit of its own - its tests
+    # are only loaded when it runs
+    return [ child for child in getattr(test, '_tests', [])
+             if isinstance(child, dtestsuite.DtestTestSuite) ]
+
+def _fix_dirnames(test):
+    """Give the sub-suites of test the dir names they get in a full run"""
+    taken = set()
+    for child in _suites(test):
+        dirname = child.dirname
+        i = 0
+        while dirname in taken:
+            i += 1
+            dirname = child.dirname + "-" + str(i)
+        taken.add(dirname)
+        child.dirname = dirname
+
+def units(suite, depth):
+    """Return the list of (path, unit) to distribute - in run order"""
+    found = []
+
+    def collect(test, level, path):
+        children = _suites(test)
+        if level == depth or not children:
+            found.append((path, test))
+            return
+        _fix_dirnames(test)
+        for child in children:
+            if not _is_fixture(child):
+                collect(child, level + 1, path + (child.dirname,))
+
+    _fix_dirnames(suite)
+    for top in _suites(suite):
+        collect(top, 0, (top.dirname,))
+    return found
+
+def assign(found, count, history=None):
+    """Return a list with the shard number (0 based) of each unit"""
+    weights = None
+    if history is not None:
+        weights = [ history.estimate(unit) for path, unit in found ]
+        if None in weights:
+            weights = None
+    if weights is None:
+        weights = [ unit.countTestCases() for path, unit in found ]
+
+    # Longest first - ties are broken on the path to stay deterministic
+    order = sorted(range(len(found)), key=lambda i: (-weights[i], found[i][0]))
+    load = [0] * count
+    shards = [None] * len(found)
+    for i in order:
+        shard = load.index(min(load))
+        shards[i] = shard
+        load[shard] += weights[i]
+    logger.debug("Shard loads: %s"%(load))
+    return shards
+
+def select(suite, index, count, depth=1, history=None):
+    """
+    Reduce suite (in place) to the units of shard index (1 based) of count.
+    Returns the number of units in the shard.
+    """
+    found = units(suite, depth)
+    shards = assign(found, count, history)
+    keep = set()
+    for (path, unit), shard in zip(found, shards):
+        if shard == index - 1:
+            for i in range(1, len(path) + 1):
+                keep.add(path[:i])
+
+    def reduce(test, path):
+        tests = []
+        for child in test._tests:
+            if not isinstance(child, dtestsuite.DtestTestSuite):
+                tests.append(child)
+                continue
+            child_path = path + (child.dirname,)
+            if child_path in keep:
+                if len(child_path) <= depth and not child.generated:
+                    reduce(child, child_path)
+                tests.append(child)
+            elif _is_fixture(child):
+                tests.append(child)
+        test._tests = tests
+
+    reduce(suite, ())
+    return len([ shard for shard in shards if shard == index - 1 ])
+
+_severity = {'FAIL': 2, 'ERROR': 2, 'SKIP': 1}
+
+def _merge_usage(mine, theirs):
+    """The resource usage of two shards - summed, except the peak rss growth"""
+    merged = dict(mine)
+    for key, value in theirs.items():
+        if not key in merged:
+            merged[key] = value
+        elif key == 'rss_delta':
+            merged[key] = max(merged[key], value)
+        else:
+            merged[key] += value
+    return merged
+
+def _merge_result(filename, other):
+    """
+    Merge the result.yaml other into filename (of another shard). The
+    start time is the earliest of the shards and the time spans until the
+    end of the latest, the resource usage is the total of the shards. All
+    other fields - including the retry counts - are those of the shard
+    with the worst result.
+    """
+    with open(filename, 'r') as f:
+        mine = yamlio.load(f)
+    with open(other, 'r') as f:
+        theirs = yamlio.load(f)
+    if not isinstance(mine, dict) or not isinstance(theirs, dict):
+        return
+    if (_severity.get(theirs.get('result'), 0) > _severity.get(mine.get('result'), 0)):
+        merged = theirs
+    else:
+        merged = mine
+    merged = dict(merged)
+    docs = (mine, theirs)
+    if all([ 'start_time' in doc for doc in docs ]):
+        merged['start_time'] = min([ doc['start_time'] for doc in docs ])
+        if all([ 'time' in doc for doc in docs ]):
+            end = max([ doc['start_time'] + doc['time'] for doc in docs ])
+            merged['time'] = end - merged['start_time']
+    if all([ isinstance(doc.get('usage'), dict) for doc in docs ]):
+        merged['usage'] = _merge_usage(mine['usage'], theirs['usage'])
+    with open(filename, 'w') as f:
+        yamlio.dump(merged, f, explicit_start=True)
+
+def merge(shard_dirs, result_dir):
+    """
+    Merge the result trees of the shards in shard_dirs into result_dir.
+    Results of the same dir in several shards (the suites enclosing the
+    units and their setup and teardown steps) are merged - the worst
+    result wins (see _merge_result). Returns the number of result files
+    written.
+    """
+    for shard_dir in shard_dirs:
+        if not os.path.isdir(shard_dir):
+            raise AssertionError("No such result dir: %s"%(shard_dir))
+
+    written = 0
+    for shard_dir in shard_dirs:
+        if os.path.exists(os.path.join(shard_dir, journal.JOURNAL_FILE)):
+            journal.export(shard_dir)
+        for dirpath, dirnames, filenames in os.walk(shard_dir):
+            rel = os.path.relpath(dirpath, shard_dir)
+            target = os.path.normpath(os.path.join(result_dir, rel))
+            if rel == '.':
+                # Journals, profiles etc. of the shards are not merged
+                filenames = []
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name in filenames:
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(target, name)
+                if not os.path.exists(dst):
+                    shutil.copy2(src, dst)
+                    if name == 'result.yaml':
+                        written += 1
+                elif name == 'result.yaml':
+                    _merge_result(dst, src)
+
+    # The merged tree holds the tests of the unsharded run
+    if os.path.exists(os.path.join(shard_dirs[0], resume.RUN_FILE)):
+        run = resume.read_run_file(shard_dirs[0])
+        run.pop('shard', None)
+        run.pop('shard_depth', None)
+        resume.write_run_file(result_dir, run.pop('tests'), **run)
+    return written
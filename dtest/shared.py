@@ -0,0 +1,110 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Setup steps shared by the suites of a run.
+#
+# Many suites start with the same setup, e.g. power cycling and booting the
+# device. A setup step marked shared is only run the first time; later
+# setup steps with the same name and params reuse its result as long as
+# nothing has changed the state of the device since:
+#
+#   setup:
+#     - dctrl.powercycle: { shared: run }
+#     - boot: { shared: until-teardown }
+#
+# A shared setup is valid until
+#
+#   - any step fails (the state of the device is unknown)
+#   - a step with the invalidates testarg has run. Its value is true
+#     (invalidating all shared setups) or a list of the names of the
+#     setups invalidated
+#   - for 'until-teardown': any teardown step has run
+#
+# The suites of a parallel batch do not share setups with each other, and
+# all shared setups are invalidated after a parallel batch.
+#
+
+import json
+import logging
+import history
+
+logger = logging.getLogger("shared")
+
+SCOPES = ('run', 'until-teardown')
+
+class SharedSetups(object):
+    """The shared setups of a run that are still valid"""
+
+    def __init__(self):
+        # key -> (name, scope, result dir of the setup)
+        self.valid = {}
+
+    def key(self, test):
+        """Return the key of the setup suite test - None if it can not be shared"""
+        k = history.testKey(test)
+        if k is None:
+            return None
+        # The same setup on another device is another setup
+        target = dict([ (arg, test.testargs[arg]) for arg in ('cfg_idx', 'device')
+                        if arg in test.testargs ])
+        return '%s:%s'%(k, json.dumps(target, sort_keys=True, default=str))
+
+    def lookup(self, test):
+        """Return the result dir of the run of an equal setup - None if not valid"""
+        k = self.key(test)
+        if k is None or not k in self.valid:
+            return None
+        return self.valid[k][2]
+
+    def record(self, test, res_dir):
+        """Record the successful run of setup test in res_dir"""
+        k = self.key(test)
+        if k is not None:
+            self.valid[k] = (test.loadname, test.testargs['shared'], res_dir)
+
+    def invalidate(self, reason, names=None, scope=None):
+        """
+        Invalidate the shared setups named in names (all if None) of
+        the given scope (all if None)
+        """
+        for k, (name, setup_scope, res_dir) in self.valid.items():
+            if names is not None and not name in names:
+                continue
+            if scope is not None and setup_scope != scope:
+                continue
+            logger.info("Shared setup %s invalidated: %s"%(name, reason))
+            del self.valid[k]
+
+    def stepDone(self, test, failed):
+        """Invalidate the setups affected by the step (or suite) test having run"""
+        if not self.valid:
+            return
+        testargs = getattr(test, 'testargs', None) or {}
+        if failed:
+            self.invalidate("%s failed"%(getattr(test, 'dirname', test)))
+        if 'invalidates' in testargs and testargs['invalidates']:
+            names = testargs['invalidates']
+            if names is True:
+                names = None
+            self.invalidate("invalidated by %s"%(getattr(test, 'dirname', test)), names)
+        if 'teardown' in testargs and testargs['teardown'] is True:
+            self.invalidate("teardown %s has run"%(getattr(test, 'dirname', test)),
+                            scope='until-teardown')
@@ -0,0 +1,152 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Cache of the parsed suite specifications (YAML files) used by the loader.
+#
+# A suite file is parsed once per load, however many suites include it.
+# With a cache directory (SPEC_CACHE in the test home for the dtest
+# command) the parsed specs are also kept across runs, pickled, one file
+# per suite file. An entry is valid while the mtime and size of the suite
+# file are unchanged, or else if the content hash is unchanged.
+#
+# Suites loaded with params are cached as templates (see yamlio.Template),
+# parsed once and constructed with the params of each inclusion.
+#
+# The cache hands out a fresh copy of a spec on every lookup, as the loader
+# modifies the specs it loads. Templates are not modified by constructing
+# them, so they are handed out as they are.
+#
+
+import os
+import hashlib
+import logging
+import cPickle
+import statefile
+
+logger = logging.getLogger("speccache")
+
+SPEC_CACHE = os.path.join(".dtest", "specs")
+
+def _stamp(filename):
+    st = os.stat(filename)
+    return (st.st_mtime, st.st_size)
+
+def _dumps(obj):
+    """Pickle obj - None if it can not be pickled"""
+    try:
+        return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    except (cPickle.PicklingError, TypeError), e:
+        logger.debug("not caching unpicklable spec: %s"%(e))
+        return None
+
+class SpecCache(object):
+    """The parsed suite files - in memory and optionally in directory"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        # filename -> entry: stamp, hash, spec (pickled) and template
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, filename):
+        return os.path.join(self.directory,
+                            hashlib.sha1(filename).hexdigest() + '.pickle')
+
+    def _read(self, filename):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(filename), 'rb') as f:
+                entry = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError, ValueError):
+            return None
+        if entry.get('filename') != filename:
+            return None
+        return entry
+
+    def _write(self, entry):
+        if self.directory is None:
+            return
+        stored = dict(entry)
+        stored.pop('text', None)
+        try:
+            statefile.replace(self._path(entry['filename']),
+                              lambda f: cPickle.dump(stored, f, cPickle.HIGHEST_PROTOCOL),
+                              'wb')
+        except (IOError, OSError, cPickle.PicklingError), e:
+            logger.warning("Could not write the spec cache %s: %s"%(self.directory, e))
+            # Kept in memory only from now on
+            self.directory = None
+
+    def _text(self, entry):
+        if not 'text' in entry:
+            with open(entry['filename'], 'rb') as f:
+                entry['text'] = f.read()
+        return entry['text']
+
+    def _entry(self, filename):
+        filename = os.path.abspath(filename)
+        stamp = _stamp(filename)
+        entry = self.entries.get(filename)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry
+        if entry is None:
+            entry = self._read(filename)
+        if entry is not None and entry['stamp'] != stamp:
+            # Touched - still valid if the content is the same
+            text = self._text({'filename': filename})
+            if hashlib.sha1(text).hexdigest() == entry['hash']:
+                entry['stamp'] = stamp
+                entry['text'] = text
+                self._write(entry)
+            else:
+                entry = None
+        if entry is None:
+            entry = {'filename': filename, 'stamp': stamp,
+                     'spec': None, 'template': None}
+            entry['hash'] = hashlib.sha1(self._text(entry)).hexdigest()
+        self.entries[filename] = entry
+        return entry
+
+    def spec(self, filename, parse):
+        """Return the spec of filename - parse(text) parses it on a miss"""
+        entry = self._entry(filename)
+        if entry['spec'] is not None:
+            self.hits += 1
+            return cPickle.loads(entry['spec'])
+        self.misses += 1
+        spec = parse(self._text(entry))
+        entry['spec'] = _dumps(spec)
+        if entry['spec'] is not None:
+            self._write(entry)
+        return spec
+
+    def template(self, filename, compose):
+        """Return the template of filename - compose(text) creates it on a miss"""
+        entry = self._entry(filename)
+        if entry.get('template') is not None:
+            self.hits += 1
+            return entry['template']
+        self.misses += 1
+        entry['template'] = compose(self._text(entry))
+        self._write(entry)
+        return entry['template']
@@ -0,0 +1,94 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# The files dtest keeps across runs in its state dir (see --state-dir): the
+# duration history, the flake database, the name index and the spec cache.
+#
+# A file is replaced in one go - written to a temporary file which is then
+# renamed - so a run never reads a partly written file. That alone does not
+# stop runs ending at the same time from dropping each other's updates, so
+# the files holding the results of runs (history, flakes) are read, merged
+# and written under an exclusive lock (see locked). The caches (name index,
+# spec cache) are not merged - the last writer wins.
+#
+# Without fcntl (Windows) nothing is locked and the last writer wins for
+# every file.
+#
+
+import os
+import json
+import logging
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("statefile")
+
+def replace(filename, write, mode='w'):
+    """
+    Replace filename with what write(f) writes to the file object f. The
+    temporary file is removed if writing fails.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.rename(tmp, filename)
+    except:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+def load_json(filename, what):
+    """Return the content of the JSON file filename - None if missing or corrupt"""
+    if filename is None or not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning("Ignoring corrupt %s %s"%(what, filename))
+        return None
+
+@contextlib.contextmanager
+def locked(filename):
+    """Hold an exclusive lock of filename (a .lock file next to it) while in the block"""
+    if fcntl is None:
+        yield
+        return
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename + '.lock', 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -21,9 +21,16 @@
 import logging
 import unittest
 import random
-from dtest.dtestcase import DtestTestCase
+import time
+import sys
+import glob
+import subprocess
+from dtest.dtestcase import DtestTestCase, AsyncDtestTestCase
 import os
-import yaml
+import shutil
+import dtest.yamlio
+import dtest.devicepool
+import dtest.matrix
 
 
 logger = logging.getLogger("selftest")
@@ -86,9 +93,33 @@ class OutputStructure(DtestTestCase):
 
         for expected_path in self.expected_content:
             folder = os.path.join(self.suite_path,expected_path)
-            self.assertTrue(os.path.exists(folder), msg="folder %s does not exist as expected"%(folder))
+            self.assertTrue(self.allocated(folder, expected_path),
+                            msg="folder %s does not exist as expected"%(folder))
         pass
 
+    def allocated(self, folder, expected_path):
+        """
+        Result dirs are only created when a result is written to them - the
+        dirs allocated to the tests count as well. Tmp dirs are created when
+        a test uses its tmpDir, so only the existing ones count.
+        """
+        if os.path.exists(folder) or self.mode != 'result' or self.dirs is None:
+            return os.path.exists(folder)
+        return self.dirs.exists(os.path.join(self._resultDir, '..', expected_path))
+
+class DirsOnAccess(DtestTestCase):
+    """The tmp and result dir of a test are created when first accessed"""
+
+    def runTest(self):
+        for name in ('tmpDir', 'resultDir'):
+            folder = getattr(self, name)
+            self.assertTrue(os.path.isdir(folder),
+                            msg="%s %s not created on access"%(name, folder))
+        # Created again if removed meanwhile
+        shutil.rmtree(self.tmpDir)
+        self.assertTrue(os.path.isdir(self.tmpDir),
+                        msg="tmpDir %s not created again on access"%(self._tmpDir))
+
 class DescriptionDocString(DtestTestCase):
     """
     Class used to test if the correct description ends up in the result files.
@@ -138,7 +169,7 @@ class OutputResultContent(DtestTestCase):
         self.assertTrue(os.path.exists(result_file), msg="folder %s does not exist as expected"%(result_file))
 
         logger.info("loading: %s"%(result_file))
-        resDict = yaml.load(file(result_file,'r'))
+        resDict = dtest.yamlio.load_file(result_file)
 
         for key in self.expected_content:
             if key in resDict:
@@ -148,3 +179,109 @@ class OutputResultContent(DtestTestCase):
             else:
                 self.fail('Missing key: %s in the result.yaml '%(key))
         pass
+
+class DeviceLeased(DtestTestCase):
+    """
+    Test that the suite is run on a device leased from the device pool.
+    """
+    def __init__(self, methodName='runTest', fake=None):
+        self.fake = fake
+        super(DeviceLeased, self).__init__(methodName)
+
+    def runTest(self):
+        device = dtest.devicepool.current()
+        self.assertIsNotNone(device, "no device leased - run with --device-pool")
+        if self.fake is not None:
+            self.assertEqual(device.fake, self.fake)
+        self.output = "device: %s"%(device.name)
+
+class AsyncOverlap(AsyncDtestTestCase):
+    """
+    Test that work submitted by an AsyncDtestTestCase runs concurrently.
+    """
+    def __init__(self, methodName='runTest', jobs=4, seconds=0.5):
+        self.jobs = jobs
+        self.seconds = seconds
+        super(AsyncOverlap, self).__init__(methodName)
+
+    def runTest(self):
+        start = time.time()
+        pending = [ self.submit(time.sleep, self.seconds) for i in range(self.jobs) ]
+        self.gather(pending)
+        elapsed = time.time() - start
+        self.assertLess(elapsed, self.seconds * self.jobs,
+                        msg="submitted jobs did not overlap (%.3fs)"%(elapsed))
+
+class ShardResume(DtestTestCase):
+    """
+    Test that an interrupted run of a shard is resumed as that shard, also
+    when --shard is not given again. The dtest command running this test
+    is run on a suite of two sub-suites in the tmp dir.
+    """
+    def __init__(self, methodName='runTest', command=None):
+        self.command = command or sys.argv[0]
+        super(ShardResume, self).__init__(methodName)
+
+    def dtest(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        env['DTESTPATH'] = 'suite'
+        process = subprocess.Popen([sys.executable, self.command] + list(args),
+                                   cwd=self.tmpDir, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0,
+                         msg="dtest %s failed:\n%s"%(' '.join(args), output))
+        return output
+
+    def runTest(self):
+        if os.path.basename(self.command) != 'dtest':
+            self.skipTest('not run by the dtest command')
+        suites = os.path.join(self.tmpDir, 'suite')
+        os.mkdir(suites)
+        with open(os.path.join(self.tmpDir, 'dtest.cfg'), 'w') as f:
+            f.write('overlays: []\n')
+        specs = {'shards': {'description': 'two shards',
+                            'tests': [{'first': None}, {'second': None}]}}
+        for name in ('first', 'second'):
+            specs[name] = {'description': name,
+                           'tests': [{'selftest.BooleanTestCase.test_pass': None}]}
+        for name, spec in specs.items():
+            with open(os.path.join(suites, name + '.yaml'), 'w') as f:
+                dtest.yamlio.dump(spec, f)
+
+        self.dtest('--shard', '1/2', '--shard-depth', '2', 'shards')
+        runs = glob.glob(os.path.join(self.tmpDir, 'result', 'dtest-run-*'))
+        self.assertEqual(len(runs), 1)
+        run = os.path.join(runs[0], 'shards')
+        ran = sorted(os.listdir(run))
+        self.assertEqual(len([ name for name in ran if name in specs ]), 1,
+                         msg="not one suite in the shard: %s"%(ran))
+
+        # Interrupted before the end of the run
+        os.remove(os.path.join(run, 'result.yaml'))
+        self.dtest('--resume', runs[0])
+        self.assertTrue(os.path.exists(os.path.join(run, 'result.yaml')),
+                        msg="the resumed run did not finish")
+        self.assertEqual(sorted(os.listdir(run)), ran,
+                         msg="the resumed run did not run the same shard")
+
+class MatrixPoints(DtestTestCase):
+    """
+    Test that the points of a matrix (e.g. with non-ASCII values) are
+    counted right and each get a dir of their own.
+    """
+    def __init__(self, methodName='runTest', matrix=None):
+        self.matrix = matrix or {'value': [u'\xfc', u'\xf6', 'plain', u'\xfc' * 80]}
+        super(MatrixPoints, self).__init__(methodName)
+
+    def runTest(self):
+        dtest.matrix.validate(self.matrix)
+        points = list(dtest.matrix.points(self.matrix))
+        self.assertEqual(dtest.matrix.size(self.matrix), len(points))
+        names = [ dtest.matrix.pointName(point) for point in points ]
+        self.assertEqual(len(set(names)), len(names),
+                         msg="points sharing a dir: %s"%(names))
+        for name in names:
+            self.assertLessEqual(len(name), dtest.matrix.MAX_NAME)
+            os.mkdir(os.path.join(self.tmpDir, name))
@@ -50,6 +50,17 @@ class tar(DtestTestCase):
         self.extractRelativeTmp = extractRelativeTmp
         super(tar, self).__init__(methodName)
 
+    def extractDir(self):
+        if self.extractRelativeTmp:
+            return os.path.join(self.tmpDir,self.extract_path)
+        return os.path.join(self.testsetup.src_path,self.extract_path)
+
+    def cacheInputs(self):
+        return [ self.filepath ] + super(tar, self).cacheInputs()
+
+    def cacheOutputs(self):
+        return [ self.extractDir() ]
+
     def runTest(self):
         """Unpack tarfile relative to srcdir"""
         try:
@@ -59,10 +70,8 @@ class tar(DtestTestCase):
                 self.fail("%s is not a tarfile."%self.filepath)
         tar = tarfile.open(self.filepath)
 
-        if self.extractRelativeTmp:
-            extractDir = os.path.join(self.tmpDir,self.extract_path)
-        else:
-            extractDir = os.path.join(self.testsetup.src_path,self.extract_path)
+        extractDir = self.extractDir()
+        if not self.extractRelativeTmp:
             if self.extract_path:
                 # Clean the dir when given and it exists already
                 if(os.path.isdir(extractDir)):
@@ -20,7 +20,7 @@
 
 import os
 import logging
-import yaml
+import yamlio
 
 logger = logging.getLogger("dtest")
 _singleton = None
@@ -39,7 +39,7 @@ def load(filename):
         return
     logging.debug("loading configuration file: %s"%(config_file))
     with open(path, "r") as file:
-        d = yaml.load(file)
+        d = yamlio.load(file)
         d = env_override(d)
         class Namespace(object):
             def __init__(self, adict):
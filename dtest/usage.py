@@ -0,0 +1,82 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Host resource accounting for test steps and suites. The usage of a step
+# is written to its result as:
+#
+#   usage:
+#     cpu:         CPU time (user + system) of the dtest process in seconds
+#     child_cpu:   CPU time of terminated child processes, e.g. power scripts
+#     rss_delta:   Growth of the peak resident set size in kB
+#     read_bytes:  Bytes read from storage by the dtest process
+#     write_bytes: Bytes written to storage by the dtest process
+#     inblock:     Block input operations (including child processes)
+#     oublock:     Block output operations (including child processes)
+#
+# read_bytes/write_bytes are only available when /proc/self/io is readable.
+# Nothing is recorded on platforms without the resource module (Windows).
+#
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _proc_io():
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+def snapshot():
+    """Return the current resource counters - or None if not supported"""
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = _proc_io()
+    return {
+        'cpu': own.ru_utime + own.ru_stime,
+        'child_cpu': children.ru_utime + children.ru_stime,
+        'maxrss': own.ru_maxrss,
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+        'inblock': own.ru_inblock + children.ru_inblock,
+        'oublock': own.ru_oublock + children.ru_oublock,
+    }
+
+def delta(start, end=None):
+    """Return the usage between two snapshots (end defaults to now)"""
+    if start is None:
+        return None
+    if end is None:
+        end = snapshot()
+    usage = {}
+    for key in ('cpu', 'child_cpu', 'inblock', 'oublock',
+                'read_bytes', 'write_bytes'):
+        if start[key] is not None and end[key] is not None:
+            usage[key] = end[key] - start[key]
+    for key in ('cpu', 'child_cpu'):
+        usage[key] = round(usage[key], 6)
+    usage['rss_delta'] = end['maxrss'] - start['maxrss']
+    return usage
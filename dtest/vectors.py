@@ -0,0 +1,192 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Data driven steps. The vectors testarg runs a test case once for every
+# row of a file of test vectors:
+#
+#   - dupdate.apply: { params: { target: rootfs }, vectors: vectors/dupdate.csv }
+#
+# The file (relative to the test home) is either CSV with a header row
+# naming the params, or JSON lines (.jsonl) with an object per line. The
+# params of a row are the params of the step updated with the values of the
+# row. CSV values which are plain decimal numbers (17, -0.5, 1e3) are
+# converted to numbers, other values - like 007, nan or inf - are kept as
+# strings.
+#
+# The rows are read one at a time while the step runs, so the file is never
+# loaded as a whole. The rows share the result and tmp dir of the step, and
+# their results are not written to a dir and a result.yaml each, but as a
+# line each in VECTOR_FILE in the result dir of the step:
+#
+#   {"row": 17, "result": "FAIL", "time": 0.012, "params": {...}, "error": "..."}
+#
+# The result.yaml of the step holds the number of rows of each result.
+# VECTOR_FILE is written anew each time the step runs, e.g. on a retry.
+#
+
+import os
+import re
+import csv
+import json
+import math
+import logging
+import dtestsuite
+import dirs
+import plan
+
+logger = logging.getLogger("vectors")
+
+VECTOR_FILE = "vectors.jsonl"
+
+_int = re.compile(r'^-?(0|[1-9][0-9]*)$')
+_float = re.compile(r'^-?((0|[1-9][0-9]*)(\.[0-9]*)?|\.[0-9]+)([eE][-+]?[0-9]+)?$')
+
+def _value(text):
+    """text as a number if it is a plain decimal int or float literal"""
+    if not isinstance(text, basestring):
+        # None or a list - a row not matching the header
+        return text
+    if _int.match(text):
+        return int(text)
+    if _float.match(text):
+        return float(text)
+    return text
+
+def _finite(value):
+    """value with the floats JSON cannot represent (nan, inf) as strings"""
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return str(value)
+    if isinstance(value, dict):
+        return dict([ (k, _finite(v)) for k, v in value.items() ])
+    if isinstance(value, (list, tuple)):
+        return [ _finite(v) for v in value ]
+    return value
+
+def rows(filename):
+    """Generate the rows (dicts of param values) of a vectors file"""
+    if filename.lower().endswith('.csv'):
+        with open(filename, 'rb') as f:
+            for row in csv.DictReader(f):
+                yield dict([ (key, _value(value)) for key, value in row.items() ])
+        return
+    with open(filename, 'r') as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError, e:
+                raise ValueError('%s:%d: %s'%(filename, number + 1, e))
+            yield dict([ (str(key), value) for key, value in row.items() ])
+
+class VectorLog(object):
+    """The results of the rows - a line each in VECTOR_FILE of the step dir"""
+
+    def __init__(self):
+        self.path = None
+        self.f = None
+        # result dir -> result -> number of rows
+        self.counts = {}
+        # The result dirs written since the step started
+        self.written = set()
+
+    def start(self):
+        """Start a run of the step - the files of a previous run are replaced"""
+        self.close()
+        self.written = set()
+
+    def append(self, path, row, params, result, seconds, error=None):
+        if path != self.path:
+            self.close()
+            dirs.materialize(path)
+            if path in self.written:
+                mode = 'a'
+            else:
+                mode = 'w'
+                self.written.add(path)
+                self.counts[path] = {}
+            self.f = open(os.path.join(path, VECTOR_FILE), mode)
+            self.path = path
+        record = {'row': row, 'result': result, 'time': seconds,
+                  'params': _finite(params)}
+        if error:
+            record['error'] = error
+        self.f.write(json.dumps(record, sort_keys=True, allow_nan=False,
+                                default=str) + '\n')
+        counts = self.counts.setdefault(path, {})
+        counts[result] = counts.get(result, 0) + 1
+
+    def summary(self, path):
+        """Return the number of rows of each result below path"""
+        total = {}
+        for p, counts in self.counts.items():
+            if p == path or p.startswith(path + os.sep):
+                for result, n in counts.items():
+                    total[result] = total.get(result, 0) + n
+        return total
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+        self.f = None
+        self.path = None
+
+class VectorSuite(dtestsuite.DtestTestSuite):
+    """The test cases (plans) of a step - run for each row of filename"""
+
+    generated = True
+
+    def __init__(self, plans, filename, dirname):
+        super(VectorSuite, self).__init__([], dirname)
+        self.plans = plans
+        self.filename = filename
+        self.log = VectorLog()
+        self.rows = None
+
+    def countTestCases(self):
+        if self.rows is None:
+            self.rows = sum([ 1 for row in rows(self.filename) ])
+        cases = self.rows * len(self.plans)
+        if 'count' in self.testargs:
+            cases *= self.testargs['count']
+        return cases
+
+    def __iter__(self):
+        self.log.start()
+        try:
+            for index, row in enumerate(rows(self.filename)):
+                for planned in self.plans:
+                    params = dict(planned.params)
+                    params.update(row)
+                    case = plan.TestPlan(planned.testCaseClass, planned.methodName, params)
+                    case.expectedFailure = planned.expectedFailure
+                    test = case.create()
+                    test.vectorLog = self.log
+                    test.vectorRow = index
+                    test.vectorParams = row
+                    yield test
+        finally:
+            self.log.close()
+
+    def resultDetails(self, res_dir):
+        return {'vectors': {'file': self.filename,
+                            'results': self.log.summary(res_dir)}}
@@ -0,0 +1,139 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# Watchdog bounding the execution time of a test step. When the timeout
+# expires StepTimeout is raised in the step (from a SIGALRM handler), so
+# the step is recorded as ERROR with the stack it was stuck in and
+# unittest proceeds to tearDown.
+#
+# Only the code of the test is watched (see StepWatch): setUp and the test
+# method share the timeout, and tearDown is given the same amount of time
+# on its own. The watchdog is never armed while unittest records the
+# outcome, so the result files of a step are not cut short.
+#
+# Steps are always run in the main thread of a process - also in the
+# worker processes of parallel suites and device pools - so each process
+# watches its own steps. The watchdog is a no-op on platforms without
+# signal.setitimer (Windows).
+#
+
+import time
+import signal
+import logging
+import unittest
+
+logger = logging.getLogger("watchdog")
+
+class StepTimeout(Exception):
+    """Raised in a test step which has run for longer than its timeout"""
+    pass
+
+class Watchdog(object):
+    """
+    Context manager raising StepTimeout in the main thread when timeout
+    seconds have passed. A timeout of None or 0 disables the watchdog.
+    limit is the timeout reported - if the watchdog is given what is left
+    of it.
+    """
+
+    def __init__(self, timeout, limit=None):
+        self.timeout = timeout
+        self.limit = limit or timeout
+        self.fired = 0
+        self.armed = False
+        self.previous = None
+
+    def expired(self, signum, frame):
+        self.fired += 1
+        raise StepTimeout("step timed out after %ss"%(self.limit))
+
+    def __enter__(self):
+        if not self.timeout or not hasattr(signal, 'setitimer'):
+            return self
+        try:
+            self.previous = signal.signal(signal.SIGALRM, self.expired)
+        except ValueError:
+            # Not the main thread - signals cannot be used
+            logger.warning("timeout of %ss not enforced outside the main thread"%(self.timeout))
+            self.timeout = None
+            return self
+        self.armed = True
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.armed:
+            return False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.previous or signal.SIG_DFL)
+        self.armed = False
+        return False
+
+class StepWatch(object):
+    """
+    Context manager bounding setUp, the test method and tearDown of the
+    test case test by watchdogs while it is run. The methods are wrapped
+    on the instance and restored on exit. A timeout of None or 0 disables
+    the watchdog.
+    """
+
+    def __init__(self, test, timeout):
+        self.test = test
+        self.timeout = timeout
+        self.deadline = None
+        self.saved = {}
+
+    def remaining(self):
+        if self.deadline is None:
+            self.deadline = time.time() + self.timeout
+        return self.deadline - time.time()
+
+    def wrap(self, name, timeout):
+        method = getattr(self.test, name)
+        self.saved[name] = self.test.__dict__.get(name)
+
+        def watched(*args, **kwargs):
+            seconds = timeout()
+            if seconds <= 0:
+                # Used up by setUp
+                raise StepTimeout("step timed out after %ss"%(self.timeout))
+            with Watchdog(seconds, self.timeout):
+                return method(*args, **kwargs)
+        setattr(self.test, name, watched)
+
+    def __enter__(self):
+        if not self.timeout or not isinstance(self.test, unittest.TestCase):
+            return self
+        # setUp and the test method share the timeout
+        self.wrap('setUp', self.remaining)
+        self.wrap(self.test._testMethodName, self.remaining)
+        self.wrap('tearDown', lambda: self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        for name, method in self.saved.items():
+            if method is None:
+                delattr(self.test, name)
+            else:
+                setattr(self.test, name, method)
+        self.saved = {}
+        self.deadline = None
+        return False
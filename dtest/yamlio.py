@@ -0,0 +1,204 @@
+#
+# Copyright (C) 2015 Prevas A/S
+#
+# This file is part of dtest, an embedded device test framework
+#
+# dtest is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# dtest is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+#
+# The YAML I/O of dtest - config files, suite files and result files.
+#
+# The libyaml based CSafeLoader/CSafeDumper are used when PyYAML is built
+# with libyaml, otherwise the pure Python SafeLoader/SafeDumper.
+#
+# Loading is safe - no Python objects are created from tags. Result files
+# written by older versions of dtest hold !!python tags, e.g. for tuples and
+# unicode strings. These load as the corresponding plain type, and objects
+# (!!python/object etc.) load as the plain mapping, sequence or string of
+# their node.
+#
+# Dumping only writes plain YAML: tuples are written as lists, and other
+# objects as their str().
+#
+# A Template is a document parsed once and constructed many times, with
+# the values of some of its anchors (&name value) replaced - the suite
+# params of the loader. The anchored values are replaced in the node graph,
+# so aliases (*name) of them get the new value as well.
+#
+
+import copy
+import yaml
+
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as _SafeDumper
+    libyaml = True
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper as _SafeDumper
+    libyaml = False
+
+YAMLError = yaml.YAMLError
+
+class Loader(_SafeLoader):
+    """Safe loader accepting the !!python tags of result files"""
+
+class Dumper(_SafeDumper):
+    """Safe dumper writing any object"""
+
+def _construct_plain(loader, suffix, node):
+    if isinstance(node, yaml.MappingNode):
+        return loader.construct_mapping(node, deep=True)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_scalar(node)
+
+def _construct_tuple(loader, node):
+    return tuple(loader.construct_sequence(node, deep=True))
+
+def _construct_unicode(loader, node):
+    return loader.construct_scalar(node)
+
+def _construct_str(loader, node):
+    value = loader.construct_scalar(node)
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
+
+Loader.add_constructor(u'tag:yaml.org,2002:python/tuple', _construct_tuple)
+Loader.add_constructor(u'tag:yaml.org,2002:python/unicode', _construct_unicode)
+Loader.add_constructor(u'tag:yaml.org,2002:python/str', _construct_str)
+Loader.add_constructor(u'tag:yaml.org,2002:python/none', Loader.construct_yaml_null)
+Loader.add_constructor(u'tag:yaml.org,2002:python/bool', Loader.construct_yaml_bool)
+Loader.add_constructor(u'tag:yaml.org,2002:python/int', Loader.construct_yaml_int)
+Loader.add_constructor(u'tag:yaml.org,2002:python/long', Loader.construct_yaml_int)
+Loader.add_constructor(u'tag:yaml.org,2002:python/float', Loader.construct_yaml_float)
+Loader.add_constructor(u'tag:yaml.org,2002:python/list', Loader.construct_yaml_seq)
+Loader.add_constructor(u'tag:yaml.org,2002:python/dict', Loader.construct_yaml_map)
+Loader.add_multi_constructor(u'tag:yaml.org,2002:python/', _construct_plain)
+
+def _represent_str(dumper, data):
+    return dumper.represent_str(str(data))
+
+Dumper.add_representer(tuple, Dumper.represent_list)
+Dumper.add_multi_representer(dict, Dumper.represent_dict)
+Dumper.add_multi_representer(list, Dumper.represent_list)
+Dumper.add_multi_representer(object, _represent_str)
+
+def load(stream):
+    """Load the single document of stream (a string or a file)"""
+    return yaml.load(stream, Loader=Loader)
+
+def load_all(stream):
+    return yaml.load_all(stream, Loader=Loader)
+
+def load_file(filename):
+    with open(filename, 'r') as f:
+        return load(f)
+
+def dump(data, stream=None, **kwargs):
+    return yaml.dump(data, stream, Dumper=Dumper, **kwargs)
+
+def dump_all(documents, stream=None, **kwargs):
+    return yaml.dump_all(documents, stream, Dumper=Dumper, **kwargs)
+
+def _mark(mark):
+    """A plain copy of mark - the marks of libyaml can not be pickled"""
+    if mark is None:
+        return None
+    return yaml.error.Mark(mark.name, mark.index, mark.line, mark.column, None, None)
+
+class Template(object):
+    """A document whose anchored values can be replaced when constructing it"""
+
+    def __init__(self, stream):
+        # anchor name -> the nodes anchored by it
+        self.anchors = {}
+        self.node = None
+        loader = Loader(stream)
+        aliases = {}
+        try:
+            loader.get_event()
+            if not loader.check_event(yaml.StreamEndEvent):
+                loader.get_event()
+                self.node = self._compose(loader, aliases)
+                loader.get_event()
+            if not loader.check_event(yaml.StreamEndEvent):
+                event = loader.get_event()
+                raise yaml.composer.ComposerError(
+                    "expected a single document in the stream", None,
+                    "but found another document", _mark(event.start_mark))
+        finally:
+            loader.dispose()
+
+    def _anchor(self, anchor, node, aliases):
+        if anchor is not None:
+            aliases[anchor] = node
+            self.anchors.setdefault(anchor, []).append(node)
+
+    def _compose(self, loader, aliases):
+        event = loader.get_event()
+        if isinstance(event, yaml.AliasEvent):
+            if not event.anchor in aliases:
+                raise yaml.composer.ComposerError(
+                    None, None, "found undefined alias %r"%(event.anchor),
+                    _mark(event.start_mark))
+            return aliases[event.anchor]
+
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == u'!':
+                tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(tag, event.value, _mark(event.start_mark),
+                                   _mark(event.end_mark), style=event.style)
+            self._anchor(event.anchor, node, aliases)
+            return node
+
+        if isinstance(event, yaml.SequenceStartEvent):
+            kind, end = yaml.SequenceNode, yaml.SequenceEndEvent
+        else:
+            kind, end = yaml.MappingNode, yaml.MappingEndEvent
+        tag = event.tag
+        if tag is None or tag == u'!':
+            tag = loader.resolve(kind, None, event.implicit)
+        node = kind(tag, [], _mark(event.start_mark), None, flow_style=event.flow_style)
+        self._anchor(event.anchor, node, aliases)
+        while not loader.check_event(end):
+            if kind is yaml.SequenceNode:
+                node.value.append(self._compose(loader, aliases))
+            else:
+                key = self._compose(loader, aliases)
+                node.value.append((key, self._compose(loader, aliases)))
+        node.end_mark = _mark(loader.get_event().end_mark)
+        return node
+
+    def construct(self, values=None):
+        """
+        Construct the document with the values anchored by the names in
+        values replaced by those. Returns the data and the set of the names
+        of values that were used.
+        """
+        used = set()
+        if self.node is None:
+            return None, used
+        loader = Loader('')
+        try:
+            for name, value in (values or {}).items():
+                for node in self.anchors.get(name, []):
+                    loader.constructed_objects[node] = copy.deepcopy(value)
+                    used.add(name)
+            return loader.construct_document(self.node), used
+        finally:
+            loader.dispose()